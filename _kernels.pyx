@@ -0,0 +1,83 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Compiled version of the kernels in kernels.py, with the same results. Build with: cythonize -i _kernels.pyx
+The lines are kept in C arrays from the bottom line up, so boards can have up to 63 lines (and 64 columns).
+"""
+
+ctypedef unsigned long long u64
+
+cdef enum:
+    MAX_LINES = 64
+
+
+def fall(tuple lines, tuple columns, tuple skyline, tuple piece_lines, tuple piece_columns, tuple bottom, int x, int height):
+    cdef int width = len(columns)
+    cdef int piece_width = len(piece_columns)
+    cdef int size = len(lines)
+    cdef int piece_size = len(piece_lines)
+    cdef int shift = width - piece_width - x + 1
+    cdef int fall_height, height_idx, newsize, idx, k
+    cdef u64 rows[MAX_LINES]
+
+    fall_height = <int>skyline[x-1] - <int>bottom[0]
+    for idx in range(1, piece_width):
+        k = <int>skyline[x-1+idx] - <int>bottom[idx]
+        if k < fall_height:
+            fall_height = k
+    height_idx = height - (fall_height + piece_size) + 1
+
+    newsize = max(size, height_idx + piece_size)
+    if newsize > MAX_LINES or height_idx < 0:
+        raise OverflowError("board too large for the compiled kernels")
+
+    # rows[k] is the line 'k' lines above the bottom one
+    for k in range(size):
+        rows[k] = <u64>lines[size-k-1]
+    for k in range(size, newsize):
+        rows[k] = 0
+    for idx in range(piece_size):
+        rows[height_idx+idx] |= (<u64>piece_lines[piece_size-idx-1]) << shift
+
+    newcolumns = list(columns)
+    for idx in range(piece_width):
+        newcolumns[x-1+idx] = (<u64>columns[x-1+idx]) | ((<u64>piece_columns[idx]) << height_idx)
+
+    return tuple([ rows[k] for k in range(newsize-1, -1, -1) ]), tuple(newcolumns)
+
+
+def clear(tuple lines, tuple columns, full_line):
+    cdef int size = len(lines)
+    cdef int width = len(columns)
+    cdef u64 full = <u64>full_line
+    cdef u64 line, low, c
+    cdef int k, idx, cleared = 0
+    cdef u64 cols[MAX_LINES]
+
+    if size >= MAX_LINES or width > MAX_LINES:
+        raise OverflowError("board too large for the compiled kernels")
+
+    newlines = []
+    for k in range(size):
+        line = <u64>lines[k]
+        if line != full:
+            newlines.append(line)
+        else:
+            cleared += 1
+    if not cleared:
+        return lines, columns
+
+    for idx in range(width):
+        cols[idx] = <u64>columns[idx]
+    # Remove the bits of the cleared lines from each column, from the top one down so that the indexes remain valid
+    for k in range(size-1, -1, -1):
+        if <u64>lines[size-k-1] == full:
+            low = ((<u64>1) << k) - 1
+            for idx in range(width):
+                c = cols[idx]
+                cols[idx] = (c & low) | ((c >> (k+1)) << k)
+
+    return tuple(newlines), tuple([ cols[idx] for idx in range(width) ])
@@ -0,0 +1,214 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Benchmark of the tree search, on a corpus of recorded states (game, piece and next pieces).
+
+    $ python3 benchmark.py record corpus.jsonl --games 5
+    $ python3 benchmark.py run corpus.jsonl --out before.json
+    $ python3 benchmark.py run corpus.jsonl --out after.json
+    $ python3 benchmark.py compare before.json after.json
+
+'record' plays games with the simulator, or replays recordings of the server (see recording.py), and saves the state of every piece.
+'run' searches every state of the corpus with fixed performance caps and no time limit, so that the plans are deterministic,
+and reports the time of each phase of the search, the nodes, the hit rates of the caches, the latency, the memory and the plans.
+'compare' reports the differences between two runs, and fails if the plans differ or the search became slower than the tolerance.
+"""
+
+import argparse
+import json
+import sys
+import tracemalloc
+from time import time
+from typing import List
+
+from bot import Bot, Game, Piece, TetrisState
+from common import percentile
+from simulator import MAX_PIECES, play
+from tree_search import SearchTree, SearchProblem, TetrisDomain
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def record(path: str, games: int=5, seed: int=1, pcaps: List[int]=[3,3,3,3], max_pieces: int=MAX_PIECES, recordings: List[str]=None):
+    """
+Save the states of the pieces of 'games' simulated games to 'path', as JSON lines. The first line has the dimensions.
+If 'recordings' are given, the states are those of the recorded games instead.
+    """
+    import recording
+
+    states = []
+    if recordings:
+        for r in recordings:
+            header = recording.load(r)[0]
+            Bot.update_dimensions(*header["dimensions"])
+            previous = None
+            for _, state in recording.replay(r):
+                # A new piece has spawned
+                if state["piece"] and (previous is None or not previous["piece"]):
+                    states.append(TetrisState.fromstate(state))
+                previous = state
+    else:
+        for s in range(seed, seed + games):
+            play(TetrisDomain(), s, pcaps=pcaps, max_pieces=max_pieces, observer=states.append)
+
+    with open(path, "w") as f:
+        f.write(json.dumps({"dimensions": Bot.dimensions}) + '\n')
+        for tstate in states:
+            f.write(json.dumps({
+                "game": tstate.game.lines,
+                "piece": tstate.piece.lines,
+                "next_pieces": [ n.lines for n in tstate.next_pieces ]
+            }) + '\n')
+    logger.info("Recorded %s states to %s", len(states), path)
+
+def load(path: str) -> List[TetrisState]:
+    with open(path) as f:
+        header = json.loads(f.readline())
+        Bot.update_dimensions(*header["dimensions"])
+        return [ TetrisState(
+                Game.fromlines(tuple(state["game"])),
+                Piece.fromlines(tuple(state["piece"])),
+                [ Piece.fromlines(tuple(n)) for n in state["next_pieces"] ])
+            for state in map(json.loads, f) ]
+
+
+def run(states: List[TetrisState], pcaps: List[int]=[3,3,3,3], memory: bool=False, expectimax: bool=False) -> dict:
+    """
+Search every state with a single domain, so that its caches are shared as in a game, and return the report.
+With 'memory', the peak of memory allocated during the searches is measured with tracemalloc, which makes them slower.
+    """
+    domain = TetrisDomain(expectimax=expectimax)
+    time_stats = {}
+    expanded = 0
+    created = 0
+    peak_open = 0
+    latencies = []
+    plans = []
+    # The banks of Bot are also used to load the corpus
+    counts = { name: (cache.hits, cache.misses) for name, cache in Bot.caches().items() }
+
+    if memory:
+        tracemalloc.start()
+    for tstate in states:
+        t = time()
+        tree = SearchTree(SearchProblem(domain, tstate, tstate), pcaps=list(pcaps), time_cap=float("inf"))
+        tree.search()
+        latencies.append(time() - t)
+
+        for key, value in tree.time_stats.items():
+            time_stats[key] = time_stats.get(key, 0) + value
+        expanded += tree.expansions
+        created += tree.memory_stats["created"]
+        peak_open = max(peak_open, tree.memory_stats["peak_open"])
+        plans.append(tree.plan)
+    peak_memory = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory:
+        tracemalloc.stop()
+
+    caches = dict(Bot.caches(), **{ "Cached games clears": domain.cached_games_clears, "Cached heuristic": domain.cached_heuristic, "Cached chance": domain.cached_chance })
+    hit_rates = {}
+    for name, cache in caches.items():
+        hits, misses = counts.get(name, (0, 0))
+        hits, misses = cache.hits - hits, cache.misses - misses
+        hit_rates[name] = hits/(hits + misses) if hits + misses else None
+    return {
+        "states": len(states),
+        "pcaps": list(pcaps),
+        "time_stats": time_stats,
+        "expanded": expanded,
+        "created": created,
+        "nodes_per_second": created/time_stats["total"] if time_stats["total"] else None,
+        "peak_open": peak_open,
+        "peak_memory": peak_memory,
+        "latency": { "p50": percentile(latencies, 50), "p90": percentile(latencies, 90), "p99": percentile(latencies, 99), "max": max(latencies) },
+        "hit_rates": hit_rates,
+        "plans": [ [ list(action) for action in plan ] for plan in plans ]
+    }
+
+def report(result: dict):
+    logger.info("%s states, pcaps %s", result["states"], result["pcaps"])
+    logger.info("Times: %s", ', '.join( "{0} {1:.3f}s".format(key, value) for key, value in result["time_stats"].items() ))
+    logger.info("Nodes: %s expanded, %s created (%.0f/s), at most %s open", result["expanded"], result["created"], result["nodes_per_second"] or 0, result["peak_open"])
+    logger.info("Latency: %s", ', '.join( "{0} {1:.1f}ms".format(key, 1000*value) for key, value in result["latency"].items() ))
+    if result["peak_memory"] is not None:
+        logger.info("Peak memory: %.1f MiB", result["peak_memory"]/2**20)
+    logger.info("Hit rates: %s", ', '.join( "{0} {1}".format(name, "-" if rate is None else "{:.1%}".format(rate)) for name, rate in result["hit_rates"].items() ))
+
+
+def compare(before: dict, after: dict, tolerance: float=0.1) -> bool:
+    """Report the differences between two runs. Returns False if the plans differ, or the total time grew by more than 'tolerance' (a fraction)."""
+    ok = True
+    if before["states"] != after["states"] or before["pcaps"] != after["pcaps"]:
+        logger.warning("The runs have different states or pcaps, only the timings are comparable")
+
+    for key in before["time_stats"]:
+        old, new = before["time_stats"][key], after["time_stats"].get(key, 0)
+        logger.info("%s: %.3fs -> %.3fs (%+.1f%%)", key, old, new, 100*(new-old)/old if old else 0)
+    for key in ("expanded", "created", "nodes_per_second", "peak_open", "peak_memory"):
+        if before[key] is not None and after[key] is not None:
+            logger.info("%s: %s -> %s", key, round(before[key]), round(after[key]))
+    for key in before["latency"]:
+        logger.info("latency %s: %.1fms -> %.1fms", key, 1000*before["latency"][key], 1000*after["latency"][key])
+
+    old, new = before["time_stats"]["total"], after["time_stats"]["total"]
+    if new > old*(1+tolerance):
+        logger.error("The search is %.1f%% slower", 100*(new-old)/old)
+        ok = False
+
+    different = [ idx for idx, (p1, p2) in enumerate(zip(before["plans"], after["plans"])) if p1 != p2 ]
+    if different:
+        logger.error("%s of %s plans differ, the first in state %s", len(different), min(len(before["plans"]), len(after["plans"])), different[0])
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    # The game's per-tick logs are only overhead here
+    logging.getLogger("Game").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_record = subparsers.add_parser("record", help="Record a corpus of states")
+    parser_record.add_argument("corpus", help="File where the corpus is saved")
+    parser_record.add_argument("--games", help="Number of games", type=int, default=5)
+    parser_record.add_argument("--seed", help="Seed of the first game", type=int, default=1)
+    parser_record.add_argument("--pcaps", help="Performance caps of the tree search that plays the games", type=int, nargs="+", default=[3, 3, 3, 3])
+    parser_record.add_argument("--max-pieces", help="Stop each game after this number of pieces (0 for no limit)", type=int, default=MAX_PIECES)
+    parser_record.add_argument("--recordings", help="Take the states from these recordings of the server instead", nargs="+", default=None)
+
+    parser_run = subparsers.add_parser("run", help="Search every state of a corpus")
+    parser_run.add_argument("corpus", help="File with the corpus")
+    parser_run.add_argument("--pcaps", help="Performance caps of the tree search", type=int, nargs="+", default=[3, 3, 3, 3])
+    parser_run.add_argument("--memory", help="Measure the peak of memory (slower)", action="store_true")
+    parser_run.add_argument("--expectimax", help="Evaluate the states with unknown pieces as chance nodes", action="store_true")
+    parser_run.add_argument("--out", help="File where the report is saved, as JSON", default=None)
+
+    parser_compare = subparsers.add_parser("compare", help="Compare the reports of two runs")
+    parser_compare.add_argument("before", help="Report of the first run")
+    parser_compare.add_argument("after", help="Report of the second run")
+    parser_compare.add_argument("--tolerance", help="Fraction of the total time that the second run can be slower by", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.corpus, args.games, args.seed, args.pcaps, args.max_pieces or None, args.recordings)
+    elif args.command == "run":
+        result = run(load(args.corpus), args.pcaps, args.memory, args.expectimax)
+        report(result)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f)
+    else:
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        sys.exit(0 if compare(before, after, args.tolerance) else 1)
@@ -3,6 +3,11 @@
 # Martinho Tavares, 98262
 
 from typing import List, Tuple
+from copy import deepcopy
+
+from shape import SHAPES
+from cache import LRUCache
+import kernels
 
 import logging
 logger = logging.getLogger(__name__)
@@ -23,26 +28,81 @@ Also includes caching and maintaining of important values for the necessary oper
     dimensions = [None, None]
     full_line = None
 
+    # For each piece, a list of its rotations in the order they are obtained by pressing 'w', with their position and bottom profile
     known_rotations = {}
+    # For each piece, the list of possible actions (rotation, translation)
+    known_actions = {}
+    # Every piece that can spawn, as it spawns
+    spawn_pieces = []
 
     @classmethod
     def update_dimensions(cls, x: int, y: int):
         cls.dimensions = [x, y]
         cls.full_line = 2**(x-2)-1
+        cls.precompute_rotations()
+
+    @classmethod
+    def precompute_rotations(cls):
+        """
+Register the rotations of every shape in shape.SHAPES, placed where the game spawns them, so that they don't have to be discovered in-game.
+The rotations are registered starting from every orientation, since a piece may be first seen in any of them.
+        """
+        cls.known_rotations = {}
+        cls.known_actions = {}
+        cls.spawn_pieces = []
+        for shape in SHAPES:
+            shape = deepcopy(shape)
+            shape.set_pos((cls.x() - shape.dimensions.x) / 2, 0)
+            rotations = []
+            for _ in range(len(shape.plan)):
+                rotations.append(shape.positions)
+                shape.rotate()
+            cls.spawn_pieces.append(Piece.fromstate(rotations[0]))
+
+            for r in range(len(rotations)):
+                piece = Piece.fromstate(rotations[r])
+                for rotation in rotations[r:] + rotations[:r]:
+                    cls.register_rotation(piece, rotation)
 
     @classmethod
     def register_rotation(cls, piece: 'Piece', rotation: List[List[int]]):
         pos = cls.top_left(rotation)
-        Bot.known_rotations.setdefault(piece, []).append( (Piece.fromstate(rotation), pos) )
+        rotated = Piece.fromstate(rotation)
+        Bot.known_rotations.setdefault(piece, []).append( (rotated, pos, rotated.bottom()) )
+        Bot.known_actions.pop(piece, None)
     
     @classmethod
-    def get_rotations(cls, piece: 'Piece') -> Tuple['Piece', Tuple[int]]:
+    def get_rotations(cls, piece: 'Piece') -> List[Tuple['Piece', Tuple[int], Tuple[int]]]:
         return Bot.known_rotations[piece]
 
+    @classmethod
+    def get_actions(cls, piece: 'Piece') -> List[Tuple[int]]:
+        """Return every (rotation, translation) action of the piece, where the translation is relative to the piece's spawn position."""
+        if piece not in cls.known_actions:
+            actions = []
+            for r, (rotation, pos, _) in enumerate(cls.get_rotations(piece)):
+                actions.extend([ (r,t-pos[0]) for t in range(1, Bot.x()-rotation.width) ])
+            cls.known_actions[piece] = actions
+        return cls.known_actions[piece]
+
     @classmethod
     def contains_rotation(cls, piece: 'Piece') -> bool:
         return piece in cls.known_rotations
 
+    @classmethod
+    def caches(cls) -> dict:
+        """Return the class-level caches of the TetrisObjects, by name."""
+        return {
+            "Game lines": Game.bank_game_lines,
+            "Piece lines": Piece.bank_piece_lines,
+            "Piece falls": Piece.bank_falls,
+        }
+
+    @classmethod
+    def resize_caches(cls, maxsize: int):
+        for cache in cls.caches().values():
+            cache.resize(maxsize)
+
     @classmethod
     def x(cls) -> int:
         return cls.dimensions[0]
@@ -92,9 +152,9 @@ class TetrisState:
     @classmethod
     # Builder method    
     def fromstate(cls, state: dict):
-        """'state' is the dictionary that is provided by the server"""
+        """'state' is the dictionary that is provided by the server, with the board already as "lines" in binary mode (see protocol.py)"""
         return TetrisState(
-            Game.fromstate( state["game"] ),
+            Game.fromlines( state["lines"] ) if "lines" in state else Game.fromstate( state["game"] ),
             Piece.fromstate( state["piece"] ),
             [ Piece.fromstate(n) for n in state["next_pieces"] ])
 
@@ -105,13 +165,11 @@ class TetrisState:
 
 class TetrisObject:
 
-    # Save results of lines_from_pos
-    bank_lines_from_pos = {}
-
     def __init__(self, lines: Tuple[int]=None, width: int=None):
         self.lines = lines
         self.width = width
         self._heights = None
+        self._columns = None
 
     @classmethod
     def lines_from_pos(cls, sqs: List[List[int]], width: int=None):
@@ -120,20 +178,14 @@ Returns a list of integers, where each is the binary representation of the rows
 - 'sqs' is a list of occupied positions.
 - 'width' is the width of the object (for example, the Game has width equal to that of the grid, while Piece uses its own width).
         """
-        key = str(sqs) + str(width)
-        if key in cls.bank_lines_from_pos:
-            return cls.bank_lines_from_pos[key]
-        
+        if not width:
+            width = max((x for x,_ in sqs), default=0)
+
+        # Single pass over the squares, no intermediate representation of the whole state is built
         h = {}
-        maxx = 0
         for x,y in sqs:
-            h.setdefault(y, []).append(x)
-            maxx = x if x > maxx else maxx
-    
-        width = width if width else maxx
-        res = tuple( sum(2**(width-x) for x in l) for _,l in sorted(h.items()) )
-        cls.bank_lines_from_pos[key] = res
-        return res
+            h[y] = h.get(y, 0) | 1 << (width-x)
+        return tuple( h[y] for y in sorted(h) )
 
     def __eq__(self, __o: object) -> bool:
         return isinstance(__o, TetrisObject) and self.lines==__o.lines
@@ -165,6 +217,18 @@ Returns a list of integers, where each is the binary representation of the rows
             self._heights = [ sorted(h, reverse=True) for h in self._heights ]
         return self._heights
 
+    def columns(self) -> Tuple[int]:
+        """Return a bit mask for each X in self.lines, where bit 'k' is set if the square 'k' lines above the bottom line is filled."""
+        if self._columns is None:
+            columns = [0]*self.width
+            for k, line in enumerate(reversed(self.lines)):
+                while line:
+                    low = line & -line
+                    columns[self.width - low.bit_length()] |= 1 << k
+                    line ^= low
+            self._columns = tuple(columns)
+        return self._columns
+
     def size(self) -> int:
         return len(self.lines)
     
@@ -178,11 +242,12 @@ Returns a list of integers, where each is the binary representation of the rows
 
 class Game(TetrisObject):
 
-    bank_game_sqs = {}
-    bank_game_lines = {}
+    bank_game_lines = LRUCache()
 
-    def __init__(self, lines: Tuple[int]=None):
+    def __init__(self, lines: Tuple[int]=None, columns: Tuple[int]=None):
         super().__init__(lines, Bot.x()-2)
+        self._columns = columns
+        self._skyline = None
         self._head = None
         self._clear = None
 
@@ -194,28 +259,28 @@ in order to recycle references.
     """
     @classmethod
     def fromstate(cls, sqs: List[List[int]]):
-        key = str(sqs)
-        if key in cls.bank_game_sqs:
-            return cls.bank_game_sqs[key]
-        
-        lines = cls.lines_from_pos(sqs, Bot.x()-2)
-        res = Game( lines )
-        cls.bank_game_sqs[key] = res
-        cls.bank_game_lines[lines] = res
-        return res
+        return cls.fromlines( cls.lines_from_pos(sqs, Bot.x()-2) )
     @classmethod
-    def fromlines(cls, lines: Tuple[int]):
+    def fromlines(cls, lines: Tuple[int], columns: Tuple[int]=None):
+        """'columns' may be given if already known, such as when derived from a parent game (see Piece.fall)."""
         key = lines
-        if key in cls.bank_game_lines:
-            return cls.bank_game_lines[key]
+        res = cls.bank_game_lines.get(key)
+        if res is not None:
+            return res
         
-        res = Game( lines )
+        res = Game( lines, columns )
         cls.bank_game_lines[key] = res
         return res
 
     def heights(self) -> List[List[int]]:
         return super().heights( Bot.y(), Bot.y()-self.size() )
 
+    def skyline(self) -> Tuple[int]:
+        """Return the height of the top square of each X (Bot.y() if the column is empty)."""
+        if self._skyline is None:
+            self._skyline = tuple( Bot.y()-c.bit_length() for c in self.columns() )
+        return self._skyline
+
     def clear(self) -> Tuple['Game', List[int]]:
         """
 Clear the complete horizontal rows out of the grid.
@@ -223,19 +288,22 @@ Return the resulting Game and a list of each clearing instance, representing the
         """
 
         if not self._clear:
-            newlines = tuple(l for l in self.lines if l!=Bot.full_line)
-            self._clear = (Game.fromlines( newlines ), self.size() - len(newlines))
+            newlines, columns = kernels.clear(self.lines, self.columns(), Bot.full_line)
+            self._clear = (Game.fromlines( newlines, columns ), self.size() - len(newlines))
 
         return self._clear
 
 class Piece(TetrisObject):
 
-    bank_piece_sqs = {}
-    bank_piece_lines = {}
-    bank_falls = {}
+    bank_piece_lines = LRUCache()
+    bank_falls = LRUCache()
 
     def __init__(self, lines: Tuple[int]=None):
         super().__init__(lines, max(len(bin(l))-2 for l in lines) if lines else None)
+
+    def bottom(self) -> Tuple[int]:
+        """Return the bottom profile of the piece: for each X, the index of its lowest square (0 being the top line)."""
+        return tuple( h[0] for h in self.heights() )
  
     """
 These methods serve the same purpose as the ones in Game.
@@ -243,20 +311,13 @@ They recycle object instances in order to prevent repeated operations.
     """
     @classmethod
     def fromstate(cls, sqs: List[List[int]]):
-        key = str(sqs)
-        if key in cls.bank_piece_sqs:
-            return cls.bank_piece_sqs[key]
-
-        lines = cls.lines_from_pos(sqs)
-        res = Piece( lines )
-        cls.bank_piece_sqs[key] = res
-        cls.bank_piece_lines[lines] = res
-        return res
+        return cls.fromlines( cls.lines_from_pos(sqs) )
     @classmethod
     def fromlines(cls, lines: Tuple[int]):
         key = lines
-        if key in cls.bank_piece_lines:
-            return cls.bank_piece_lines[key]
+        res = cls.bank_piece_lines.get(key)
+        if res is not None:
+            return res
         
         res = Piece( lines )
         cls.bank_piece_lines[key] = res
@@ -264,30 +325,14 @@ They recycle object instances in order to prevent repeated operations.
 
     def fall(self, game: Game, r: int, t: int) -> Game:
         key = (self, game, r, t)
-        if key in Piece.bank_falls:
-            return Piece.bank_falls[key]
+        res = Piece.bank_falls.get(key)
+        if res is not None:
+            return res
 
         # Do the rotation and the translation
-        piece, pos = Bot.get_rotations(self)[r]
-        pos = (pos[0]+t, pos[1])
-
-        top_heights = [ h[-1] for h in game.heights()[pos[0]-1:pos[0]+piece.width-1] ]
-        bot_heights = [ h[0] for h in piece.heights() ]
-        fall_height = min(top-bot for top, bot in zip(top_heights, bot_heights))
-        height_idx = Bot.y() - (fall_height + piece.size()) + 1
-        newlines = list(game.lines)
-
-        shifted_lines_idx = 0
-        shifted_lines = tuple( l<<(game.width - piece.width - pos[0] + 1) for l in piece.lines )
-
-        for line_idx in range(height_idx, game.size()):
-            newlines[-line_idx-1] |= shifted_lines[-shifted_lines_idx-1]
-            shifted_lines_idx += 1
-            if not shifted_lines_idx < piece.size():
-                break
-        for line_idx in range(shifted_lines_idx, piece.size()):
-            newlines[:0] = [shifted_lines[-line_idx-1]]
-
-        res = Game.fromlines( tuple(newlines) )
+        piece, pos, bot_heights = Bot.get_rotations(self)[r]
+
+        newlines, columns = kernels.fall(game.lines, game.columns(), game.skyline(), piece.lines, piece.columns(), bot_heights, pos[0]+t, Bot.y())
+        res = Game.fromlines( newlines, columns )
         Piece.bank_falls[key] = res
         return res
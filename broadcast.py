@@ -0,0 +1,91 @@
+"""Broadcast of game messages to the clients of the server.
+
+Each client has a Subscriber, with a bounded queue of messages that its own task
+sends, so that the game never waits for a client. When a client falls behind and
+its queue is full, the oldest game states are dropped: they are stale anyway.
+A client in delta mode can't skip a frame, so it is sent a keyframe instead,
+replacing all its queued states (see protocol.py).
+"""
+import asyncio
+import logging
+from collections import deque
+
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger("Broadcast")
+logger.setLevel(logging.INFO)
+
+QUEUE_SIZE = 8
+
+# Kinds of messages
+INFO = "info"  # not a game state, never dropped
+STATE = "state"
+KEYFRAME = "keyframe"
+
+
+class Subscriber:
+    """A client of the server, receiving messages in the given protocol mode."""
+
+    def __init__(self, ws, mode="full", maxsize=QUEUE_SIZE):
+        self.ws = ws
+        self.mode = mode
+        self.maxsize = maxsize
+        # The room whose states the client received last, and whether its next state must be a keyframe
+        self.room = None
+        self.needs_keyframe = True
+        self.dropped = 0
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._task = asyncio.ensure_future(self._send())
+
+    @property
+    def backlogged(self):
+        return len(self._queue) >= self.maxsize
+
+    def put(self, message, kind=STATE):
+        """Queue a message, without waiting."""
+        if kind != INFO and self.backlogged:
+            if self.mode == "delta":
+                self._drop(lambda queued: True)
+                if kind != KEYFRAME:
+                    self.needs_keyframe = True
+                    return
+            else:
+                self._drop(lambda queued: queued is self._oldest_state())
+
+        self._queue.append((kind, message))
+        self._drained.clear()
+        self._ready.set()
+
+    def _oldest_state(self):
+        return next((queued for queued in self._queue if queued[0] != INFO), None)
+
+    def _drop(self, condition):
+        kept = deque(queued for queued in self._queue if queued[0] == INFO or not condition(queued))
+        self.dropped += len(self._queue) - len(kept)
+        self._queue = kept
+
+    async def _send(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._drained.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                _, message = self._queue.popleft()
+                await self.ws.send(message)
+        except ConnectionClosed:
+            self._queue.clear()
+            self._drained.set()
+
+    async def drain(self, timeout=1.0):
+        """Wait until the queued messages are sent, for at most 'timeout' seconds."""
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Client too slow, %s messages not sent", len(self._queue))
+
+    def close(self):
+        self._task.cancel()
@@ -0,0 +1,99 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Search budget of the agent, which chooses the performance caps (depth and width) of SearchTree so that each search ends well before the piece lands.
+"""
+
+from collections import deque
+from typing import Dict, List, Tuple
+
+from bot import Bot
+from common import percentile
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class BudgetController:
+    """
+Keeps the latency of the searches, separately for each performance caps configuration, and adjusts 'pcaps' (in place) after each piece:
+- if the expected latency (in frames) plus 'headroom' is lower than the frames remaining before the piece lands, the search is made wider, or deeper once the last level has 'max_width';
+- if the expected latency plus 'margin' is greater than the remaining frames, it's made narrower, or shallower once the last level has width 1.
+The expected latency is the 'percentile' of the last 'window' searches with the current configuration, so that single slow searches don't shrink the search by themselves.
+    """
+
+    def __init__(self, pcaps: List[int], max_width: int=3, margin: int=8, headroom: int=25, percentile: float=90, window: int=20, frames: int=3):
+        # Otherwise a configuration could be grown into and shrunk out of after every piece
+        if margin > headroom:
+            raise ValueError("The margin ({0}) can't be greater than the headroom ({1})".format(margin, headroom))
+        self.pcaps = pcaps
+        self.max_depth = len(pcaps)
+        self.max_width = max_width
+        self.margin = margin
+        self.headroom = headroom
+        self.percentile = percentile
+        self.window = window
+        # Number of frames that a single search can take at most
+        self.frames = frames
+        # Latencies in seconds, for each configuration of pcaps
+        self.latencies: Dict[Tuple[int], deque] = {}
+
+    def time_cap(self, game_speed: int) -> float:
+        """Time limit of a search, with the game at 'game_speed' frames per second."""
+        return self.frames/game_speed
+
+    def record(self, latency: float):
+        self.latencies.setdefault(tuple(self.pcaps), deque(maxlen=self.window)).append(latency)
+
+    def expected_latency(self, pcaps: List[int]=None) -> float:
+        """Latency of a configuration (the current one by default) at the 'percentile', in seconds. It's 0 until a search has been recorded with it."""
+        return percentile(self.latencies.get(tuple(self.pcaps if pcaps is None else pcaps), ()), self.percentile)
+
+    @classmethod
+    def remaining_frames(cls, game: List[List[int]]) -> int:
+        """Frames before a piece spawned at the top reaches the stack of 'game' (the "game" from the server's state), falling one line per frame."""
+        return min(y for _, y in game) if game else Bot.y()
+
+    def update(self, state: dict, latency: float=None) -> List[int]:
+        """Record the 'latency' of the search done for this piece, if any, and adjust the performance caps to the board of 'state'. Returns them."""
+        if latency is not None:
+            self.record(latency)
+
+        # The stack has no empty rows, so in binary mode it reaches the top of "lines"
+        remaining = Bot.y()-len(state["lines"]) if "lines" in state else self.remaining_frames(state["game"])
+        expected = self.expected_latency()*state["game_speed"]
+        if expected + self.headroom < remaining:
+            # Don't grow into a configuration that is known to be too slow, but forget its oldest latency, so that it's tried again eventually
+            grown = self.grown()
+            if grown and self.expected_latency(grown)*state["game_speed"] + self.margin <= remaining:
+                self.pcaps[:] = grown
+                logger.debug("Growing search to %s", self.pcaps)
+            elif grown:
+                self.latencies[tuple(grown)].popleft()
+        elif expected + self.margin > remaining:
+            self.shrink()
+        return self.pcaps
+
+    def grown(self) -> List[int]:
+        """The next wider or deeper configuration, or None if the search can't grow."""
+        if self.pcaps[-1] < self.max_width:
+            return self.pcaps[:-1] + [self.pcaps[-1]+1]
+        if len(self.pcaps) < self.max_depth:
+            return self.pcaps + [1]
+        return None
+
+    def shrink(self):
+        if self.pcaps[-1] > 1:
+            self.pcaps[-1] -= 1
+        elif len(self.pcaps) > 1:
+            self.pcaps.pop()
+        else:
+            return
+        logger.debug("Shrinking search to %s", self.pcaps)
+
+    def __str__(self) -> str:
+        return '\n'.join( "{0}: {1} searches, {2:.1f}ms at p{3:g}".format(list(pcaps), len(latencies), 1000*percentile(latencies, self.percentile), self.percentile)
+            for pcaps, latencies in sorted(self.latencies.items()) )
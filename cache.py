@@ -0,0 +1,75 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+from collections import OrderedDict
+
+# Default limit on the number of entries of each cache
+DEFAULT_MAXSIZE = 2**16
+
+_MISSING = object()
+
+class LRUCache:
+    """
+Dictionary-like cache with a limit on the number of entries, evicting the least recently used ones.
+Lookups done with get() are counted as hits or misses. A 'maxsize' of None means the cache is unbounded.
+    """
+
+    def __init__(self, maxsize: int=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = value
+        self._evict()
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def values(self):
+        return self._data.values()
+
+    def resize(self, maxsize: int):
+        self.maxsize = maxsize
+        self._evict()
+
+    def clear(self):
+        self._data.clear()
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __str__(self) -> str:
+        return "size {0}/{1}, hits {2}, misses {3}, evictions {4}".format(len(self), self.maxsize, self.hits, self.misses, self.evictions)
+
+    def __repr__(self) -> str:
+        return str(self)
@@ -1,3 +1,11 @@
 from collections import namedtuple
 
 Dimensions = namedtuple("Dimensions", ["x", "y"])
+
+
+def percentile(values, p):
+    """The 'p' percentile of 'values' (nearest rank), or 0 if there are no values."""
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
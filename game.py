@@ -1,11 +1,12 @@
 from asyncio.queues import Queue
+from collections import deque
 import logging
 import random
 import asyncio
-from common import Dimensions
+import time
+from common import Dimensions, percentile
 from copy import deepcopy
 from shape import SHAPES
-from collections import Counter
 
 logger = logging.getLogger("Game")
 logger.setLevel(logging.DEBUG)
@@ -14,12 +15,97 @@ GAME_SPEED = 10
 SPEED_STEP = 10  # points
 
 
+SHAPES_BY_NAME = {shape.name: shape for shape in SHAPES}
+
+
+def random_pieces(rng=random):
+    """Endless iterator of random piece names, drawn from 'rng'.
+
+    Draws the same pieces as a Game without 'pieces', given the same random state.
+    """
+    while True:
+        yield rng.choice(SHAPES).name
+
+
+class TickScheduler:
+    """Wait for the ticks of a game at absolute deadlines of the monotonic clock.
+
+    Each deadline is one period (at the current speed) after the previous one, so
+    the time spent between ticks doesn't make the game slower than its speed. A
+    tick whose work runs past the next deadline is an overrun; if a tick is more
+    than a period late, the following ones are scheduled from it instead of
+    being rushed to catch up.
+    """
+
+    def __init__(self, window=1000, clock=time.monotonic, sleep=asyncio.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline = None
+        self.ticks = 0
+        self.overruns = 0
+        self.max_lateness = 0
+        self._total_lateness = 0
+        # Lateness of the last 'window' ticks, for its percentiles
+        self._lateness = deque(maxlen=window)
+
+    async def wait(self, speed):
+        """Wait for the next tick of a game at 'speed' ticks per second."""
+        period = 1.0 / speed
+        now = self._clock()
+        self._deadline = now + period if self._deadline is None else self._deadline + period
+        if self._deadline > now:
+            await self._sleep(self._deadline - now)
+        else:
+            self.overruns += 1
+
+        lateness = self._clock() - self._deadline
+        self.ticks += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        self._total_lateness += lateness
+        self._lateness.append(lateness)
+        if lateness > period:
+            self._deadline = self._clock()
+        return lateness
+
+    def percentile(self, p):
+        """Lateness at the 'p' percentile of the last ticks, in seconds."""
+        return percentile(self._lateness, p)
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "mean": self._total_lateness / self.ticks if self.ticks else 0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max_lateness,
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return "{} ticks, {} overruns, lateness mean {:.1f} ms, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+            stats["ticks"], stats["overruns"], *(1000 * stats[key] for key in ("mean", "p50", "p99", "max"))
+        )
+
+
 class Game:
-    def __init__(self, x=10, y=30) -> None:
+    def __init__(self, x=10, y=30, pieces=None, recorder=None) -> None:
+        """Create a game.
+
+        'pieces' is an iterator of piece names (such as the pieces of a recorded
+        game), by default the pieces are random. If a 'recorder' is given, its
+        piece() and key() methods are called with each new piece and each key
+        handled (see recording.GameRecorder).
+        """
         logger.info("Game")
         self.dimensions = Dimensions(x, y)
         self.current_piece = None
-        self.next_pieces = [deepcopy(random.choice(SHAPES)) for _ in range(3)]
+        self._pieces = pieces
+        self.recorder = recorder
+        self.ticks = 0
+        # Real time ticks of loop()
+        self.scheduler = TickScheduler()
+        self.next_pieces = [self.new_piece() for _ in range(3)]
 
         self._bottom = [(i, y) for i in range(x)]  # bottom
         self._lateral = [(0, i) for i in range(y)]  # left
@@ -27,7 +113,11 @@ class Game:
 
         self.grid = self._bottom + self._lateral
 
-        self.game = []
+        # Bitboard: one integer per row, with the same layout as the client's
+        # bot.TetrisObject.lines (column 1 is the most significant bit)
+        self._rows = [0] * y
+        self._full_row = 2 ** (x - 2) - 1
+        self._game = []
         self.score = 0
         self.speed = 1
         self.game_speed = 10
@@ -35,6 +125,15 @@ class Game:
 
         self.running = True
 
+    def new_piece(self):
+        if self._pieces is None:
+            shape = random.choice(SHAPES)
+        else:
+            shape = SHAPES_BY_NAME[next(self._pieces)]
+        if self.recorder:
+            self.recorder.piece(shape.name)
+        return deepcopy(shape)
+
     def info(self):
         return {
             "dimensions": self.dimensions,
@@ -43,27 +142,47 @@ class Game:
             "score": self.score
         }
 
+    @property
+    def rows(self):
+        """The bitboard, one integer per row from the top."""
+        return self._rows
+
+    @property
+    def game(self):
+        """Occupied cells, derived from the bitboard."""
+        if self._game is None:
+            width = self.dimensions.x - 2
+            self._game = [
+                (x, y)
+                for y, row in enumerate(self._rows)
+                if row
+                for x in range(1, width + 1)
+                if row >> (width - x) & 1
+            ]
+        return self._game
+
+    def _bit(self, x):
+        return 1 << (self.dimensions.x - 2 - x)
+
+    def lock(self, piece):
+        """Add the piece's cells to the board."""
+        for x, y in piece.positions:
+            self._rows[y] |= self._bit(x)
+        self._game = None
+
     def clear_rows(self):
-        lines = 0
-
-        for item, count in sorted(Counter(y for _, y in self.game).most_common()):
-            if count == len(self._bottom) - 2:
-                self.game = [
-                    (x, y + 1) if y < item else (x, y)
-                    for (x, y) in self.game
-                    if y != item
-                ]  # remove row and drop lines
-                lines += 1
-                logger.debug("Clear line %s", item)
+        rows = [row for row in self._rows if row != self._full_row]
+        lines = len(self._rows) - len(rows)
+        if lines:
+            logger.debug("Clear %s lines", lines)
+            self._rows = [0] * lines + rows  # remove rows and drop lines
+            self._game = None
 
         self.score += lines ** 2
 
         self.game_speed = GAME_SPEED + self.score // SPEED_STEP
 
-        most_common = Counter(y for _, y in self.game).most_common(1)
-        if most_common != []:
-            (_, count) = most_common[0]
-            assert count != len(self._bottom) - 2, f"please create an issue https://github.com/dgomes/ia-tetris/issues sharing:\n {self.game}"
+        assert self._full_row not in self._rows, f"please create an issue https://github.com/dgomes/ia-tetris/issues sharing:\n {self.game}"
 
     def keypress(self, key):
         """Update locally last key pressed."""
@@ -71,10 +190,24 @@ class Game:
 
     async def loop(self):
         logger.info("Loop - score: %s - speed: %s", self.score, self.game_speed)
-        await asyncio.sleep(1.0 / self.game_speed)
+        await self.scheduler.wait(self.game_speed)
+        return self.step()
+
+    def step(self, key=None):
+        """Advance the game by one tick, without waiting, and return its state.
+
+        If 'key' is given it is handled as if it had been pressed during this tick.
+        """
+        if key is not None:
+            self.keypress(key)
+
+        self.ticks += 1
+        if self.recorder and self._lastkeypress:
+            self.recorder.key(self.ticks, self._lastkeypress)
+
         if self.current_piece is None:
             self.current_piece = self.next_pieces.pop(0)
-            self.next_pieces.append(deepcopy(random.choice(SHAPES)))
+            self.next_pieces.append(self.new_piece())
 
             logger.debug("New piece: %s", self.current_piece)
             self.current_piece.set_pos(
@@ -110,7 +243,7 @@ class Game:
 
         else:
             self.current_piece.y -= 1
-            self.game.extend(self.current_piece.positions)
+            self.lock(self.current_piece)
 
             self.clear_rows()
 
@@ -128,9 +261,14 @@ class Game:
         }
 
     def valid(self, piece):
-        return not any(
-            [piece_part in self.grid for piece_part in piece.positions]
-        ) and not any([piece_part in self.game for piece_part in piece.positions])
+        for x, y in piece.positions:
+            if not 0 < x < self.dimensions.x - 1 or y >= self.dimensions.y:
+                return False  # walls and bottom
+            if y >= 0 and self._rows[y] & self._bit(x):
+                return False
+        return True
 
     def collide_lateral(self, piece):
-        return any([piece_part in self._lateral for piece_part in piece.positions])
+        return any(
+            x <= 0 or x >= self.dimensions.x - 1 for x, _ in piece.positions
+        )
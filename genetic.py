@@ -0,0 +1,155 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Implementation of a genetic algorithm for hyperparameter optimization of TetrisDomain, equivalent to scripts/gen.sh.
+Check http://www.scholarpedia.org/article/Genetic_algorithms and https://en.wikipedia.org/wiki/Genetic_algorithm.
+
+Instead of starting servers and clients, the games are played with the in-process simulator,
+and the whole population is evaluated in parallel across all cores.
+Every individual plays the same seeded games, so they all see the same piece sequences.
+"""
+
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from simulator import MAX_PIECES, play
+from tree_search import TetrisDomain
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The parameters of TetrisDomain.__init__, in order
+PARAMS = ["HOLES", "MAX_HEIGHT", "AVG_HEIGHT", "HEIGHT_VARIANCE", "CLEARED_LINES", "CONTINUITY", "CENTER_SCALE", "HOLES_SCALE", "CLEARED_LINES_SCALE"]
+# A "chromosome" is an integer of 135 bits, 15 bits for each of the parameters (max value: 32767)
+GENE_BITS = 15
+CHROMOSOME_BITS = GENE_BITS*len(PARAMS)
+
+
+def decode(chromosome: int) -> List[int]:
+    """Extract each parameter from the chromosome. The first parameter is in the most significant bits."""
+    return [ (chromosome >> (GENE_BITS*idx)) & (2**GENE_BITS-1) for idx in reversed(range(len(PARAMS))) ]
+
+def encode(params: List[int]) -> int:
+    chromosome = 0
+    for param in params:
+        chromosome = (chromosome << GENE_BITS) | (param & (2**GENE_BITS-1))
+    return chromosome
+
+
+def game_score(params: List[int], seed: int, pcaps: List[int], max_pieces: int) -> int:
+    """Play one game with the given parameters. Runs in a worker process."""
+    return play(TetrisDomain(*params), seed, pcaps=pcaps, max_pieces=max_pieces).score
+
+def evaluate(executor: ProcessPoolExecutor, population: List[int], seeds: List[int], pcaps: List[int], max_pieces: int) -> Dict[int, float]:
+    """Return the fitness of each individual, which is the mean score of its games. All games of the population run concurrently."""
+    individuals = set(population)
+    futures = {
+        individual: [ executor.submit(game_score, decode(individual), seed, pcaps, max_pieces) for seed in seeds ]
+        for individual in individuals
+    }
+    return { individual: sum(f.result() for f in fs)/len(fs) for individual, fs in futures.items() }
+
+
+def crossover(parent1: int, parent2: int, rng: random.Random):
+    """Each pair of parents creates two children, separated at a random point of the chromosomes."""
+    delimiter = rng.randrange(CHROMOSOME_BITS)
+    tail = 2**(CHROMOSOME_BITS-delimiter) - 1
+    return (parent1 & ~tail) | (parent2 & tail), (parent2 & ~tail) | (parent1 & tail)
+
+def mutate(individual: int, mutation_chance: int, rng: random.Random) -> int:
+    """Flip one random bit, with a chance of 'mutation_chance'/32768."""
+    if rng.randrange(32768) < mutation_chance:
+        individual ^= 1 << rng.randrange(CHROMOSOME_BITS)
+    return individual
+
+
+def next_generation(population: List[int], fitness: Dict[int, float], mutation_chance: int, rng: random.Random) -> List[int]:
+    # Select best half of individuals according to fitness (the larger half, if the population is odd)
+    best_size = (len(population)+1)//2
+    sorted_individuals = sorted(population, key=lambda i: fitness[i])[-best_size:]
+
+    # 'step' is solely used for parent pair selection among the best half
+    offspring = []
+    step = best_size//2
+    for idx in range(best_size):
+        parent1 = sorted_individuals[idx]
+        parent2 = sorted_individuals[(idx+step)%best_size]
+        offspring.extend(crossover(parent1, parent2, rng))
+    # An odd population has one child too many
+    offspring = offspring[:len(population)]
+
+    offspring = [ mutate(individual, mutation_chance, rng) for individual in offspring ]
+
+    # Apply elitism: the best individual is kept for the next generation (guarantees that we always have the best solution found so far)
+    offspring[0] = sorted_individuals[-1]
+    return offspring
+
+
+def save_best(params: List[int], path: str="best.txt"):
+    with open(path, "w") as f:
+        f.write(' '.join('{}={}'.format(name, value) for name, value in zip(PARAMS, params)) + '\n')
+
+
+def run(population_size: int=10, mutation_chance: int=32768, number_of_games: int=10, generations: int=None,
+    workers: int=None, seed: int=1, pcaps: List[int]=[3,3,3,3], max_pieces: int=MAX_PIECES, initial: List[int]=None, out: str="best.txt"):
+    """
+Run the genetic algorithm for 'generations' generations (forever if None), saving the best parameters to 'out' after each one.
+'initial' can be used to initialize the population with values from previous runs, or custom ones.
+    """
+    if population_size < 2:
+        raise ValueError(f"The population must have at least 2 individuals, not {population_size}")
+    rng = random.Random()
+    population = [ rng.getrandbits(CHROMOSOME_BITS) for _ in range(population_size) ]
+    if initial:
+        population[0] = encode(initial)
+    seeds = list(range(seed, seed + number_of_games))
+
+    generation = 0
+    best = None
+    with ProcessPoolExecutor(workers) as executor:
+        try:
+            while generations is None or generation < generations:
+                logger.info("Generation %s", generation)
+                fitness = evaluate(executor, population, seeds, pcaps, max_pieces)
+
+                best = max(population, key=lambda i: fitness[i])
+                logger.info("Best fitness: %s %s", fitness[best], decode(best))
+                save_best(decode(best), out)
+
+                population = next_generation(population, fitness, mutation_chance, rng)
+                generation += 1
+        except KeyboardInterrupt:
+            logger.info("Interrupted, the best parameters are in %s", out)
+
+    return decode(best) if best is not None else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--population", help="Population size", type=int, default=10)
+    parser.add_argument("--mutation-chance", help="Mutation chance, measured as x/32768", type=int, default=32768)
+    parser.add_argument("--games", help="Number of games per individual", type=int, default=10)
+    parser.add_argument("--generations", help="Number of generations, unlimited by default", type=int, default=None)
+    parser.add_argument("--workers", help="Number of worker processes, all cores by default", type=int, default=None)
+    parser.add_argument("--seed", help="Seed of the first game", type=int, default=1)
+    parser.add_argument("--pcaps", help="Performance caps of the tree search", type=int, nargs="+", default=[3, 3, 3, 3])
+    parser.add_argument("--max-pieces", help="Stop each game after this number of pieces (0 for no limit)", type=int, default=MAX_PIECES)
+    parser.add_argument("--out", help="File where the best parameters are saved", default="best.txt")
+    args = parser.parse_args()
+
+    # Can initialize with values from previous runs, or custom ones
+    initial = [ os.environ.get(name) for name in PARAMS ]
+    initial = [ int(value) for value in initial ] if all(initial) else None
+
+    run(args.population, args.mutation_chance, args.games, args.generations,
+        args.workers, args.seed, args.pcaps, args.max_pieces or None, initial, args.out)
@@ -0,0 +1,134 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Kernels of Piece.fall() and Game.clear(), on plain tuples of lines and columns (with the layouts of TetrisObject.lines and TetrisObject.columns()).
+If the compiled version in _kernels.pyx has been built (`cythonize -i _kernels.pyx`), it's used instead, otherwise the Python version below is.
+The compiled kernels give the same results, with boards of up to 63 lines; on larger boards they raise OverflowError, and the Python version is used for that call.
+
+Running this file checks that both versions agree on a corpus of random boards and compares their speed (tests/test_kernels.py checks them too).
+"""
+
+from typing import Tuple
+
+
+def fall(lines: Tuple[int], columns: Tuple[int], skyline: Tuple[int], piece_lines: Tuple[int], piece_columns: Tuple[int], bottom: Tuple[int], x: int, height: int) -> Tuple[Tuple[int], Tuple[int]]:
+    """
+Drop a piece (already rotated) whose leftmost column is at 'x' (starting at 1), onto the board with the given lines, columns and skyline.
+'bottom' is the bottom profile of the piece and 'height' the height of the grid (Bot.y()). Return the lines and columns of the resulting board.
+    """
+    width = len(columns)
+    piece_width = len(piece_columns)
+    piece_size = len(piece_lines)
+
+    fall_height = min(top-bot for top, bot in zip(skyline[x-1:x+piece_width-1], bottom))
+    height_idx = height - (fall_height + piece_size) + 1
+    newlines = list(lines)
+
+    shifted_lines_idx = 0
+    shifted_lines = tuple( l<<(width - piece_width - x + 1) for l in piece_lines )
+
+    for line_idx in range(height_idx, len(lines)):
+        newlines[-line_idx-1] |= shifted_lines[-shifted_lines_idx-1]
+        shifted_lines_idx += 1
+        if not shifted_lines_idx < piece_size:
+            break
+    for line_idx in range(shifted_lines_idx, piece_size):
+        newlines[:0] = [shifted_lines[-line_idx-1]]
+
+    # Only the columns touched by the piece change
+    newcolumns = list(columns)
+    for idx, column in enumerate(piece_columns):
+        newcolumns[x-1+idx] |= column << height_idx
+
+    return tuple(newlines), tuple(newcolumns)
+
+def clear(lines: Tuple[int], columns: Tuple[int], full_line: int) -> Tuple[Tuple[int], Tuple[int]]:
+    """Remove the lines equal to 'full_line'. Return the lines and columns of the resulting board."""
+    newlines = tuple(l for l in lines if l!=full_line)
+    # Remove the bits of the cleared lines from each column, from the top one down so that the indexes remain valid
+    for k in range(len(lines)-1, -1, -1):
+        if lines[-k-1] == full_line:
+            low = (1 << k) - 1
+            columns = tuple( (c & low) | ((c >> (k+1)) << k) for c in columns )
+    return newlines, columns
+
+
+python_fall = fall
+python_clear = clear
+
+try:
+    from _kernels import fall as compiled_fall, clear as compiled_clear
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
+if COMPILED:
+    def fall(*args) -> Tuple[Tuple[int], Tuple[int]]:
+        try:
+            return compiled_fall(*args)
+        except OverflowError:
+            return python_fall(*args)
+
+    def clear(lines: Tuple[int], columns: Tuple[int], full_line: int) -> Tuple[Tuple[int], Tuple[int]]:
+        try:
+            return compiled_clear(lines, columns, full_line)
+        except OverflowError:
+            return python_clear(lines, columns, full_line)
+
+
+def corpus(size: int=20000, seed: int=0) -> list:
+    """
+The arguments of 'size' falls, on the boards reached by dropping random pieces at random places, starting empty, restarting when the board fills up.
+Bot.update_dimensions() must have been called.
+    """
+    import random
+    from bot import Bot, Game
+
+    rng = random.Random(seed)
+    falls = []
+    game = Game.fromlines(())
+    while len(falls) < size:
+        piece = rng.choice(Bot.spawn_pieces)
+        r, t = rng.choice(Bot.get_actions(piece))
+        rotated, pos, bottom = Bot.get_rotations(piece)[r]
+        args = (game.lines, game.columns(), game.skyline(), rotated.lines, rotated.columns(), bottom, pos[0]+t, Bot.y())
+        falls.append(args)
+        lines, columns = python_fall(*args)
+        lines, columns = python_clear(lines, columns, Bot.full_line)
+        game = Game.fromlines(lines, columns) if len(lines) < Bot.y()-4 else Game.fromlines(())
+    return falls
+
+
+if __name__ == "__main__":
+    from time import time
+
+    from bot import Bot
+
+    Bot.update_dimensions(10, 30)
+    if not COMPILED:
+        print("The compiled kernels aren't built, build them with: cythonize -i _kernels.pyx")
+
+    corpus = corpus()
+
+    mismatches = 0
+    for args in corpus:
+        expected = python_fall(*args)
+        mismatches += fall(*args) != expected
+        mismatches += clear(*expected, Bot.full_line) != python_clear(*expected, Bot.full_line)
+    print("Corpus of {0} falls, {1} mismatches".format(len(corpus), mismatches))
+
+    falls = [ python_fall(*args) for args in corpus ]
+    for name, fall_kernel, clear_kernel in (("python", python_fall, python_clear), ("compiled", fall, clear)):
+        if name == "compiled" and not COMPILED:
+            break
+        t = time()
+        for args in corpus:
+            fall_kernel(*args)
+        fall_time = time() - t
+        t = time()
+        for lines, columns in falls:
+            clear_kernel(lines, columns, Bot.full_line)
+        clear_time = time() - t
+        print("{0}: {1:.0f} falls/s, {2:.0f} clears/s".format(name, len(corpus)/fall_time, len(falls)/clear_time))
@@ -0,0 +1,174 @@
+"""Wire protocol between the server and its clients (players and viewers).
+
+Clients choose the mode of the game states they receive in the join command,
+{"cmd": "join", ..., "mode": MODE}:
+- "full" (default): every tick is a JSON object with the whole state;
+- "delta": every tick is a JSON object with the position of the piece, plus only
+  the other fields of the state that changed (the board is only sent when a piece
+  locks or rows are cleared). A keyframe, with the whole state and "keyframe": true,
+  is sent every KEYFRAME_INTERVAL ticks and whenever a client starts receiving a game;
+- "binary": every tick is a binary message with the whole state, packed with
+  encode_binary: the board as one integer per row, with the same layout as the
+  client's bot.TetrisObject.lines (column 1 is the most significant bit), and each
+  piece as its shape (index in shape.SHAPES), rotation and position. The decoded
+  state has the board as "lines", the rows from the top of the stack to the bottom,
+  so clients don't have to convert it, and "game" only if they ask for it.
+
+Messages that aren't game states (the game information sent on join and at the end
+of the game, without "piece") are always sent whole.
+DeltaEncoder is used by the server, and the clients decode any mode with Decoder.
+"""
+import json
+import struct
+
+from shape import SHAPES
+
+MODES = ("full", "delta", "binary")
+KEYFRAME_INTERVAL = 100
+
+# game speed, score, number of next pieces, board height, number of rows sent, board width
+HEADER = struct.Struct("!HIBBBB")
+# shape, rotation, x, y
+PIECE = struct.Struct("!BBbb")
+NO_PIECE = 255
+# format of the rows, by their size in bytes
+ROW_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+SHAPE_IDS = {shape.name: i for i, shape in enumerate(SHAPES)}
+# cells of each rotation of each shape, relative to its position
+CELLS = [
+    [
+        [(x, y) for y, line in enumerate(plan) for x, pos in enumerate(line) if pos == "1"]
+        for plan in shape.plan
+    ]
+    for shape in SHAPES
+]
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":"))
+
+
+def decode(message):
+    return json.loads(message)
+
+
+def _row_format(width):
+    return next(ROW_FORMATS[size] for size in sorted(ROW_FORMATS) if width <= 8 * size)
+
+
+def _pack_piece(piece):
+    if piece is None:
+        return PIECE.pack(NO_PIECE, 0, 0, 0)
+    return PIECE.pack(SHAPE_IDS[piece.name], piece.rotation, piece.x, piece.y)
+
+
+def _unpack_piece(message, offset):
+    shape, rotation, x, y = PIECE.unpack_from(message, offset)
+    if shape == NO_PIECE:
+        return None
+    return [[x + cx, y + cy] for cx, cy in CELLS[shape][rotation]]
+
+
+def encode_binary(state, game):
+    """Encode the state of 'game' (a server game.Game) in binary mode."""
+    rows = game.rows
+    top = next((y for y, row in enumerate(rows) if row), len(rows))
+    width = game.dimensions.x - 2
+    return b"".join(
+        [
+            HEADER.pack(
+                state["game_speed"], state["score"], len(game.next_pieces), len(rows), len(rows) - top, width
+            ),
+            _pack_piece(game.current_piece),
+            *(_pack_piece(piece) for piece in game.next_pieces),
+            struct.pack(f"!{len(rows) - top}{_row_format(width)}", *rows[top:]),
+            state.get("player", "").encode(),
+        ]
+    )
+
+
+class DeltaEncoder:
+    """Encode consecutive states of a game as delta frames."""
+
+    def __init__(self, interval=KEYFRAME_INTERVAL):
+        self.interval = interval
+        self._previous = None
+        self._ticks = 0
+
+    def keyframe(self):
+        """Make the next frame a keyframe."""
+        self._previous = None
+
+    def encode(self, state):
+        previous = self._previous
+        if previous is None or self._ticks % self.interval == 0:
+            frame = dict(state, keyframe=True)
+        else:
+            frame = {
+                key: value
+                for key, value in state.items()
+                # The board is the same object until it changes (see Game.game)
+                if key == "piece" or (value is not previous.get(key) and value != previous.get(key))
+            }
+        self._previous = state
+        self._ticks += 1
+        return frame
+
+
+class Decoder:
+    """Decode the messages of a connection in the given mode, returning whole states.
+
+    In binary mode, the occupied cells of the board ("game") are only decoded if
+    'positions' is true, "lines" has the board in every state.
+    """
+
+    def __init__(self, mode="full", positions=True):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+        self.mode = mode
+        self.positions = positions
+        self.state = None
+
+    def decode_binary(self, message):
+        game_speed, score, count, height, size, width = HEADER.unpack_from(message)
+        offset = HEADER.size
+        piece, *next_pieces = [_unpack_piece(message, offset + i * PIECE.size) for i in range(count + 1)]
+        offset += (count + 1) * PIECE.size
+        row_format = _row_format(width)
+        rows = struct.unpack_from(f"!{size}{row_format}", message, offset)
+        offset += size * struct.calcsize(row_format)
+
+        state = {
+            "lines": tuple(row for row in rows if row),
+            "piece": piece,
+            "next_pieces": next_pieces,
+            "game_speed": game_speed,
+            "score": score,
+        }
+        if self.positions:
+            state["game"] = [
+                [x, y]
+                for y, row in enumerate(rows, height - size)
+                if row
+                for x in range(1, width + 1)
+                if row >> (width - x) & 1
+            ]
+        if offset < len(message):
+            state["player"] = message[offset:].decode()
+        return state
+
+    def decode(self, message):
+        if self.mode == "binary":
+            # Messages that aren't game states are sent as JSON
+            return decode(message) if isinstance(message, str) else self.decode_binary(message)
+
+        message = decode(message)
+        if self.mode == "full" or "piece" not in message:
+            return message
+
+        if message.pop("keyframe", False) or self.state is None:
+            self.state = message
+        else:
+            self.state = dict(self.state, **message)
+        return self.state
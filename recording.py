@@ -0,0 +1,119 @@
+"""Game recordings.
+
+A recording is a file of JSON lines, appended to as the game is played:
+- a header, {"seed": ..., "player": ..., "dimensions": [x, y]};
+- the name of each new piece, such as "S";
+- each key handled by the game, as [tick, key];
+- the result, {"score": ..., "ticks": ...}, once the game is over.
+
+Replaying the pieces and keys through game.Game reconstructs every tick's state.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from game import Game
+
+logger = logging.getLogger("Recording")
+logger.setLevel(logging.INFO)
+
+
+class GameRecorder:
+    """Record a game to 'path'."""
+
+    def __init__(self, path, seed, player, dimensions):
+        self.path = path
+        # Line buffered, so that the recording is complete up to the last line even if the server stops.
+        # A new file, so that two games never write to the same recording
+        self._file = open(path, "x", buffering=1)
+        self._write({"seed": seed, "player": player, "dimensions": list(dimensions)})
+
+    @classmethod
+    def create(cls, directory, seed, player, dimensions, number=0):
+        """Start a new recording in 'directory', named after the time, the 'number' of the game and the player."""
+        os.makedirs(directory, exist_ok=True)
+        name = "{}-{}-{}.jsonl".format(
+            time.strftime("%Y%m%d-%H%M%S"), number, "".join(c for c in player if c.isalnum())
+        )
+        return cls(os.path.join(directory, name), seed, player, dimensions)
+
+    def _write(self, data):
+        self._file.write(json.dumps(data, separators=(",", ":")) + "\n")
+
+    def piece(self, name):
+        self._write(name)
+
+    def key(self, tick, key):
+        self._write([tick, key])
+
+    def close(self, score, ticks):
+        self._write({"score": score, "ticks": ticks})
+        self._file.close()
+
+
+def load(path):
+    """Return the header, piece names, keys by tick and result (None if the game didn't finish) of a recording."""
+    header = None
+    pieces = []
+    keys = {}
+    result = None
+    with open(path) as infile:
+        for line in infile:
+            data = json.loads(line)
+            if isinstance(data, str):
+                pieces.append(data)
+            elif isinstance(data, list):
+                keys[data[0]] = data[1]
+            elif header is None:
+                header = data
+            else:
+                result = data
+    return header, pieces, keys, result
+
+
+def replay(path):
+    """Replay a recording, yielding the tick number and state of every tick."""
+    header, pieces, keys, result = load(path)
+    game = Game(*header["dimensions"], pieces=iter(pieces))
+    while game.running:
+        try:
+            state = game.step(keys.get(game.ticks + 1))
+        except StopIteration:
+            # The recording stops before the end of the game
+            return
+        yield game.ticks, state
+        if result and game.ticks >= result["ticks"]:
+            return
+
+
+def state_at(path, tick):
+    """Return the state of the game at 'tick'."""
+    for t, state in replay(path):
+        if t == tick:
+            return state
+    raise ValueError(f"{path} has no tick {tick}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    logging.getLogger("Game").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", help="recording file")
+    parser.add_argument("--tick", help="print the state at this tick", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.tick is not None:
+        print(json.dumps(state_at(args.recording, args.tick)))
+    else:
+        header, _, _, result = load(args.recording)
+        ticks, state = 0, None
+        for ticks, state in replay(args.recording):
+            pass
+        logger.info("<%s>, seed %s: %s ticks, score %s", header["player"], header["seed"], ticks, state["score"] if state else None)
+        if result and (result["score"], result["ticks"]) != (state["score"], ticks):
+            logger.error("The replay doesn't match the recorded result %s", result)
@@ -1,6 +1,7 @@
 """Network Game Server."""
 import argparse
 import asyncio
+import itertools
 import json
 import logging
 import os.path
@@ -13,7 +14,10 @@ import requests
 from requests import RequestException
 import websockets
 
-from game import Game
+import broadcast
+import protocol
+from game import Game, random_pieces
+from recording import GameRecorder
 
 logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -30,55 +34,214 @@ HIGHSCORE_FILE = "highscores.json"
 MAX_HIGHSCORES = 10
 
 
+class Room:
+    """A game being played, with its player and tick task."""
+
+    def __init__(self, server, player, number):
+        self.server = server
+        self.player = player
+        # Number of the game in this server, which tells apart the recordings of the same player
+        self.number = number
+        # Each game draws its pieces from its own generator, so that concurrent
+        # games with the same seed get the same pieces
+        rng = random.Random(server.seed) if server.seed > 0 else random.Random()
+
+        recorder = None
+        if server.record:
+            recorder = GameRecorder.create(
+                server.record, server.seed, player.name, server.game.dimensions, number
+            )
+            logger.info("Recording to %s", recorder.path)
+        self.game = Game(pieces=random_pieces(rng), recorder=recorder)
+        self._answered = asyncio.Event()
+        self.task = None
+        # Delta frames are encoded once per tick for all the clients in delta mode
+        self._delta = protocol.DeltaEncoder()
+
+    def keypress(self, key):
+        self.game.keypress(key)
+        self._answered.set()
+
+    def subscribers(self):
+        """Subscribers of the player and the viewers of this game."""
+        clients = [self.player.ws] + self.server.viewers_of(self)
+        return [self.server.clients[ws] for ws in clients if ws in self.server.clients]
+
+    def send_info(self, game_info, highscores=False):
+        """Send game info to viewers and player."""
+        if highscores:
+            game_info["highscores"] = self.server.highscores
+            game_info["player"] = self.player.name
+
+        message = protocol.encode(game_info)
+        for subscriber in self.subscribers():
+            subscriber.put(message, broadcast.INFO)
+
+    def send_state(self, state):
+        """Send a game state to the player and viewers, encoded once per mode."""
+        subscribers = self.subscribers()
+        modes = {subscriber.mode for subscriber in subscribers}
+        messages = {}
+        if "full" in modes:
+            messages["full"] = protocol.encode(state)
+        if "binary" in modes:
+            messages["binary"] = protocol.encode_binary(state, self.game)
+        delta = keyframe = None
+        if "delta" in modes:
+            frame = self._delta.encode(state)
+            delta = protocol.encode(frame)
+            if frame.get("keyframe"):
+                keyframe = delta
+        else:
+            self._delta.keyframe()
+
+        for subscriber in subscribers:
+            # Clients that weren't receiving this game need a keyframe
+            if subscriber.room is not self:
+                subscriber.room = self
+                subscriber.needs_keyframe = True
+
+            if subscriber.mode != "delta":
+                subscriber.put(messages[subscriber.mode])
+            elif subscriber.needs_keyframe or subscriber.backlogged or delta is keyframe:
+                if keyframe is None:
+                    keyframe = protocol.encode(dict(state, keyframe=True))
+                subscriber.needs_keyframe = False
+                subscriber.put(keyframe, broadcast.KEYFRAME)
+            else:
+                subscriber.put(delta)
+
+    async def tick(self):
+        """Advance the game by one tick.
+
+        In simulation mode the tick happens as soon as the player answers the
+        previous state (an empty key is a valid answer), or after the usual tick
+        period if it doesn't.
+        """
+        if not self.server.simulate:
+            return await self.game.loop()
+
+        try:
+            await asyncio.wait_for(self._answered.wait(), 1.0 / self.game.game_speed)
+        except asyncio.TimeoutError:
+            pass
+        self._answered.clear()
+        return self.game.step()
+
+    async def run(self):
+        """Run the game until it's over or the player disconnects.
+
+        States are queued to the clients (see broadcast.py), so the game never
+        waits for them.
+        """
+        try:
+            logger.info("Starting game for <%s>", self.player.name)
+
+            game_info = await self.tick()
+            self.send_state(game_info)
+
+            if self.server.grading:
+                game_record = dict()
+                game_record["player"] = self.player.name
+
+            while self.game.running:
+                if self.player.ws.closed:
+                    logger.info("<%s> disconnected", self.player.name)
+                    return
+
+                state = await self.tick()
+                state["player"] = self.player.name
+
+                self.send_state(state)
+            self.server.save_highscores(self.player.name, self.game.score)
+
+            game_info = self.game.info()
+            game_info["player"] = self.player.name
+
+            self.send_info(game_info, highscores=True)
+            subscriber = self.server.clients.get(self.player.ws)
+            if subscriber:
+                await subscriber.drain()
+            await self.player.ws.close()
+        finally:
+            if not self.server.simulate:
+                logger.info("Ticks of <%s>: %s", self.player.name, self.game.scheduler)
+            if self.game.recorder:
+                self.game.recorder.close(self.game.score, self.game.ticks)
+
+            try:
+                if self.server.grading:
+                    game_record["score"] = self.game.score
+                    requests.post(self.server.grading, json=game_record, timeout=2)
+            except RequestException as err:
+                logger.error(err)
+                logger.warning("Could not save score to server")
+
+            if not self.player.ws.closed:
+                logger.info("Disconnecting <%s>", self.player.name)
+                await self.player.ws.close()
+
+
 class GameServer:
-    """Network Game Server."""
+    """Network Game Server, running up to 'max_games' games at once."""
 
-    def __init__(self, level, timeout, seed=0, grading=None):
+    def __init__(self, level, timeout, seed=0, grading=None, simulate=False, record=None, max_games=1):
         self.seed = seed
+        # Only used for the information about a new game, sent when clients join
         self.game = Game()
         self.players = asyncio.Queue()
-        self.viewers = set()
-        self.current_player = None
+        # Viewers, with the name of the player whose game they follow
+        # (None follows the oldest game running)
+        self.viewers = {}
+        # Subscriber of each client, with its protocol mode (see broadcast.py and protocol.py)
+        self.clients = {}
         self.grading = grading
         self._level = level  # game level
         self._timeout = timeout  # timeout for game
-
-        self._highscores = []
+        # Advance the game as soon as the player answers, instead of in real time
+        self.simulate = simulate
+        # Directory where each game is recorded, if any
+        self.record = record
+        self.max_games = max_games
+        # Rooms of the games running, oldest first, and the room of each player's websocket
+        self.rooms = []
+        self._rooms_by_ws = {}
+        self._room_numbers = itertools.count(1)
+
+        self.highscores = []
         if os.path.isfile(HIGHSCORE_FILE):
             with open(HIGHSCORE_FILE, "r") as infile:
-                self._highscores = json.load(infile)
-                # print(self._highscores)
+                self.highscores = json.load(infile)
+                # print(self.highscores)
 
-    def save_highscores(self, score):
+    def save_highscores(self, name, score):
         """Update highscores, storing to file."""
         logger.debug("Save highscores")
         logger.info(
             "%s FINAL SCORE <%s>",
-            self.current_player.name,
+            name,
             score,
         )
 
-        self._highscores.append((self.current_player.name, score))
-        self._highscores = sorted(self._highscores, key=lambda s: s[1], reverse=True)[
+        self.highscores.append((name, score))
+        self.highscores = sorted(self.highscores, key=lambda s: s[1], reverse=True)[
             :MAX_HIGHSCORES
         ]
 
-        # print(self._highscores)
+        # print(self.highscores)
 
         with open(HIGHSCORE_FILE, "w") as outfile:
-            json.dump(self._highscores, outfile)
+            json.dump(self.highscores, outfile)
 
-    async def send_info(self, game_info, highscores=False):
-        """Send game info to viewer and player."""
-        if highscores:
-            game_info["highscores"] = self._highscores
-            game_info["player"] = self.current_player.name
+    def room_of(self, name):
+        """Room followed by viewers of 'name', the oldest one if there's no such game."""
+        for room in self.rooms:
+            if room.player.name == name:
+                return room
+        return self.rooms[0] if self.rooms else None
 
-        if self.viewers:
-            await asyncio.wait(
-                [client.send(json.dumps(game_info)) for client in self.viewers]
-            )
-        await self.current_player.ws.send(json.dumps(game_info))
+    def viewers_of(self, room):
+        return [ws for ws, name in self.viewers.items() if self.room_of(name) is room]
 
     async def incomming_handler(self, websocket, path):
         """Process new clients arriving at the server."""
@@ -88,87 +251,79 @@ class GameServer:
                 if not "cmd" in data:
                     continue
                 if data["cmd"] == "join":
+                    game = self.game
+                    mode = data.get("mode", "full")
+                    if mode not in protocol.MODES:
+                        logger.warning("Unknown mode %s, using full", mode)
+                        mode = "full"
+                    if websocket in self.clients:
+                        self.clients[websocket].close()
+                    subscriber = self.clients[websocket] = broadcast.Subscriber(websocket, mode)
                     if path == "/player":
                         logger.info("<%s> has joined", data["name"])
                         await self.players.put(Player(data["name"], websocket))
 
                     if path == "/viewer":
                         logger.info("Viewer connected")
-                        self.viewers.add(websocket)
-
-                    game_info = self.game.info()
-                    await websocket.send(json.dumps(game_info))
-
-                if data["cmd"] == "key" and self.current_player.ws == websocket:
-                    logger.debug((self.current_player.name, data))
+                        # Viewers may choose the game they follow, by the player's name
+                        self.viewers[websocket] = data.get("player")
+                        room = self.room_of(data.get("player"))
+                        if room:
+                            game = room.game
+
+                    game_info = game.info()
+                    subscriber.put(protocol.encode(game_info), broadcast.INFO)
+
+                room = self._rooms_by_ws.get(websocket)
+                if data["cmd"] == "key" and room:
+                    logger.debug((room.player.name, data))
                     if len(data["key"]) > 0:
-                        self.game.keypress(data["key"][0])
+                        room.keypress(data["key"][0])
                     else:
-                        self.game.keypress("")
+                        room.keypress("")
 
         except websockets.exceptions.ConnectionClosed as closed_reason:
             logger.info("Client disconnected: %s", closed_reason)
-            if websocket in self.viewers:
-                self.viewers.remove(websocket)
+        finally:
+            self.viewers.pop(websocket, None)
+            subscriber = self.clients.pop(websocket, None)
+            if subscriber:
+                subscriber.close()
+                if subscriber.dropped:
+                    logger.info("Dropped %s states for a slow client", subscriber.dropped)
 
     async def mainloop(self):
-        """Main loop, runing the Game."""
+        """Main loop, admitting the players waiting into new games, up to 'max_games' at once."""
+        slots = asyncio.Semaphore(self.max_games)
         while True:
+            await slots.acquire()
             logger.info("Waiting for player")
-            self.current_player = await self.players.get()
+            player = await self.players.get()
 
-            if self.current_player.ws.closed:
-                logger.error("<%s> disconnect while waiting", self.current_player.name)
+            if player.ws.closed:
+                logger.error("<%s> disconnect while waiting", player.name)
+                slots.release()
                 continue
 
             try:
-                logger.info("Starting game for <%s>", self.current_player.name)
-                if self.seed > 0:
-                    random.seed(self.seed)
-
-                self.game = Game()
-
-                game_info = await self.game.loop()
-                await self.send_info(game_info)
-
-                if self.grading:
-                    game_record = dict()
-                    game_record["player"] = self.current_player.name
-
-                while self.game.running:
-                    state = await self.game.loop()
-                    state["player"] = self.current_player.name
-
-                    state = json.dumps(state)
-
-                    await self.current_player.ws.send(state)
-                    if self.viewers:
-                        await asyncio.wait(
-                            [client.send(state) for client in self.viewers]
-                        )
-                self.save_highscores(self.game.score)
-
-                game_info = self.game.info()
-                game_info["player"] = self.current_player.name
-
-                await self.send_info(game_info, highscores=True)
-                await self.current_player.ws.close()
-                self.current_player = None
-
-            except websockets.exceptions.ConnectionClosed:
-                self.current_player = None
-            finally:
-                try:
-                    if self.grading:
-                        game_record["score"] = self.game.score
-                        requests.post(self.grading, json=game_record, timeout=2)
-                except RequestException as err:
-                    logger.error(err)
-                    logger.warning("Could not save score to server")
+                room = Room(self, player, next(self._room_numbers))
+            except FileExistsError as err:
+                logger.error("Could not record the game of <%s>: %s", player.name, err)
+                await player.ws.close()
+                slots.release()
+                continue
+            self.rooms.append(room)
+            self._rooms_by_ws[player.ws] = room
+            room.task = asyncio.ensure_future(room.run())
+            room.task.add_done_callback(lambda _, room=room: self.close_room(room, slots))
 
-                if self.current_player:
-                    logger.info("Disconnecting <%s>", self.current_player.name)
-                    await self.current_player.ws.close()
+    def close_room(self, room, slots):
+        if not room.task.cancelled() and room.task.exception():
+            logger.error("Game of <%s> failed: %r", room.player.name, room.task.exception())
+        self.rooms.remove(room)
+        self._rooms_by_ws.pop(room.player.ws, None)
+        slots.release()
+        logger.info("Game of <%s> is over, %s running", room.player.name, len(self.rooms))
 
 
 if __name__ == "__main__":
@@ -181,9 +336,22 @@ if __name__ == "__main__":
         help="url of grading server",
         default="http://atnog-tetriscores.av.it.pt/game",
     )
+    parser.add_argument(
+        "--simulate",
+        help="advance the game as fast as the player answers",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--record", help="directory where each game is recorded", default=None
+    )
+    parser.add_argument(
+        "--max-games", help="number of games played at once", type=int, default=1
+    )
     args = parser.parse_args()
 
-    g = GameServer(0, -1, args.seed, args.grading_server)
+    g = GameServer(
+        0, -1, args.seed, args.grading_server, args.simulate, args.record, args.max_games
+    )
 
     game_loop_task = asyncio.ensure_future(g.mainloop())
 
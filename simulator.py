@@ -0,0 +1,143 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+In-process simulator.
+Plays games of 'game.Game' with the tree search agent directly, without the server, websockets or JSON,
+in order to quickly evaluate a set of TetrisDomain parameters.
+"""
+
+import argparse
+import random
+from collections import namedtuple
+from time import time
+from typing import Callable, List
+
+from game import Game
+from bot import Bot, TetrisState
+from tree_search import SearchTree, SearchProblem, TetrisDomain
+from worker import ParallelSearch
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+# The game's per-tick logs are only overhead here
+logging.getLogger("Game").setLevel(logging.WARNING)
+
+# In-process games have no clock pressure to end them, and a good agent may never lose, so games stop after this number of pieces by default
+MAX_PIECES = 1000
+
+GameResult = namedtuple("GameResult", ["seed", "score", "pieces", "ticks", "time"])
+
+
+def play(domain: TetrisDomain, seed: int=0, pcaps: List[int]=[3,3,3,3], time_cap: float=None, max_pieces: int=MAX_PIECES, anytime: bool=False, parallel: ParallelSearch=None,
+    observer: Callable[[TetrisState], None]=None) -> GameResult:
+    """
+Play a whole game and return its result.
+- 'seed' is used in the same way as the server's, so the piece sequence is the same as in 'server.py --seed'.
+- 'time_cap' is the time limit of each search. If None, the search is not limited by time, so the game is deterministic.
+- 'max_pieces' stops the game after that number of pieces has been placed (None for no limit).
+- 'anytime' searches every piece with SearchTree.search_anytime(), reusing the tree of the previous piece, instead of following the whole plan.
+- 'parallel' searches with the root's actions split between its processes (created with the same domain). Its own 'anytime' is used instead.
+- 'observer' is called with the state of each piece, as it spawns (used to record the states of a benchmark, for example).
+    """
+    if seed > 0:
+        random.seed(seed)
+    game = Game()
+    Bot.update_dimensions(game.dimensions.x, game.dimensions.y)
+    time_cap = float("inf") if time_cap is None else time_cap
+
+    # actions list, used with lookahead
+    actions = []
+    t = None
+    pieces = 0
+    ticks = 1
+    tt = time()
+    state = game.step()
+    while game.running and (max_pieces is None or pieces < max_pieces):
+        if not state["piece"]:
+            state = game.step()
+            ticks += 1
+            continue
+
+        tstate = TetrisState.fromstate(state)
+        if observer:
+            observer(tstate)
+
+        if parallel:
+            if not actions or parallel.anytime:
+                actions = parallel.search(tstate, pcaps, time_cap)
+        elif not actions or anytime:
+            problem = SearchProblem(domain, tstate, tstate)
+            if anytime:
+                if t is None or not t.reroot(problem):
+                    t = SearchTree(problem, pcaps=list(pcaps), time_cap=time_cap)
+                t.search_anytime()
+            else:
+                t = SearchTree(problem, pcaps=list(pcaps), time_cap=time_cap)
+                t.search()
+            actions = t.plan
+
+        action_r, action_t = actions.pop(0)
+        decided_move_path = ['w']*action_r + (['a'] if action_t < 0 else ['d'])*abs(action_t) + ['s']
+        for key in decided_move_path:
+            state = game.step(key)
+            ticks += 1
+            if not state["piece"]:
+                break
+
+        # Let the piece lock
+        while state["piece"] and game.running:
+            state = game.step()
+            ticks += 1
+        pieces += 1
+
+    return GameResult(seed, game.score, pieces, ticks, time() - tt)
+
+
+def simulate(domain: TetrisDomain, games: int=10, seed: int=1, **kwargs) -> List[GameResult]:
+    """Play 'games' games with consecutive seeds, starting at 'seed'. The remaining arguments are passed to play()."""
+    results = []
+    for s in range(seed, seed + games):
+        result = play(domain, s, **kwargs)
+        logger.info("Game %s: score %s, %s pieces, %.2fs", s, result.score, result.pieces, result.time)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", help="Number of games", type=int, default=10)
+    parser.add_argument("--seed", help="Seed of the first game", type=int, default=1)
+    parser.add_argument("--pcaps", help="Performance caps of the tree search", type=int, nargs="+", default=[3, 3, 3, 3])
+    parser.add_argument("--time-cap", help="Time limit of each search, unlimited by default", type=float, default=None)
+    parser.add_argument("--max-pieces", help="Stop each game after this number of pieces (0 for no limit)", type=int, default=MAX_PIECES)
+    parser.add_argument("--params", help="The 9 TetrisDomain parameters, in order", type=int, nargs=9, default=None)
+    parser.add_argument("--anytime", help="Use the anytime search", action="store_true")
+    parser.add_argument("--expectimax", help="Evaluate the states with unknown pieces as chance nodes", action="store_true")
+    parser.add_argument("--parallel", help="Split the search between this number of processes (0 for all cores)", type=int, default=None)
+    args = parser.parse_args()
+
+    tetris = TetrisDomain(*args.params, expectimax=args.expectimax) if args.params else TetrisDomain(expectimax=args.expectimax)
+    parallel = None
+    if args.parallel is not None:
+        # The processes need the dimensions at startup
+        dimensions = Game().dimensions
+        Bot.update_dimensions(dimensions.x, dimensions.y)
+        parallel = ParallelSearch(tetris, args.parallel or None, args.anytime)
+    results = simulate(tetris, args.games, args.seed,
+        pcaps=args.pcaps,
+        time_cap=args.time_cap,
+        max_pieces=args.max_pieces or None,
+        anytime=args.anytime,
+        parallel=parallel)
+    if parallel:
+        parallel.shutdown()
+
+    logger.info("Average score: %s", sum(r.score for r in results)/len(results))
+    logger.info("Total time: %.2fs", sum(r.time for r in results))
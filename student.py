@@ -18,9 +18,23 @@ import time as tm
 
 import websockets
 OUT = os.environ.get("OUT", None)
+# search every piece with the anytime search, reusing the tree of the previous piece
+ANYTIME = os.environ.get("ANYTIME", None)
+# search in a background process, receiving game updates in the meantime
+WORKER = os.environ.get("WORKER", None)
+# split the search between this number of processes (0 for all cores)
+PARALLEL = os.environ.get("PARALLEL", None)
+# evaluate the states beyond the known pieces as chance nodes over every piece
+EXPECTIMAX = os.environ.get("EXPECTIMAX", None)
+# mode of the states sent by the server (see protocol.py)
+PROTOCOL = os.environ.get("PROTOCOL", "full")
 
 from tree_search import SearchTree, SearchProblem, TetrisDomain
-from bot import Bot, Piece, Game, TetrisObject, TetrisState
+from bot import Bot, Piece, TetrisState
+from cache import DEFAULT_MAXSIZE
+from worker import SearchWorker, ParallelSearch
+from budget import BudgetController
+from protocol import Decoder
 
 import logging
 
@@ -45,12 +59,32 @@ CONTINUITY = int(os.environ.get("CONTINUITY", "-1"))
 CENTER_SCALE = int(os.environ.get("CENTER_SCALE", "-1"))
 HOLES_SCALE = int(os.environ.get("HOLES_SCALE", "-1"))
 CLEARED_LINES_SCALE = int(os.environ.get("CLEARED_LINES_SCALE", "-1"))
+# maximum number of entries of each cache
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "-1"))
+
+def board(state: dict):
+    """The board of a state from the server, as lines in binary mode (see protocol.py)."""
+    return state["lines"] if "lines" in state else state["game"]
+
+async def receive_until(websocket, decoder: Decoder, future: asyncio.Future, state: dict) -> dict:
+    """Keep receiving game updates until 'future' is done, so that we don't get out of sync with the server. Returns the latest state."""
+    while not future.done():
+        receive = asyncio.ensure_future(websocket.recv())
+        await asyncio.wait({future, receive}, return_when=asyncio.FIRST_COMPLETED)
+        if receive.done():
+            state = decoder.decode(receive.result())
+        else:
+            # Canceling recv() doesn't lose messages
+            receive.cancel()
+    return state
 
 async def agent_loop(server_address="localhost:8000", agent_name="student"):
     async with websockets.connect(f"ws://{server_address}/player") as websocket:
 
         # Receive information about static game properties
-        await websocket.send(json.dumps({"cmd": "join", "name": agent_name}))
+        await websocket.send(json.dumps({"cmd": "join", "name": agent_name, "mode": PROTOCOL}))
+        # The cells of the board aren't needed in binary mode, TetrisState uses its lines
+        decoder = Decoder(PROTOCOL, positions=False)
 
         # number of the piece for curiosity
         piece_n = 1
@@ -60,8 +94,10 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
         prev_game = None
         # tetris domain
         tetris = None
+        cache_size = CACHE_SIZE if CACHE_SIZE!=-1 else DEFAULT_MAXSIZE
+        Bot.resize_caches(cache_size)
         if HOLES==-1 or MAX_HEIGHT==-1 or AVG_HEIGHT==-1 or HEIGHT_VARIANCE==-1 or CLEARED_LINES==-1 or CONTINUITY==-1 or CENTER_SCALE==-1 or HOLES_SCALE==-1 or CLEARED_LINES_SCALE==-1:
-            tetris = TetrisDomain()
+            tetris = TetrisDomain(cache_size=cache_size, expectimax=bool(EXPECTIMAX))
         else:
             tetris = TetrisDomain(
                 HOLES=HOLES,
@@ -72,17 +108,27 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                 CONTINUITY=CONTINUITY,
                 CENTER_SCALE=CENTER_SCALE,
                 HOLES_SCALE=HOLES_SCALE,
-                CLEARED_LINES_SCALE=CLEARED_LINES_SCALE)
+                CLEARED_LINES_SCALE=CLEARED_LINES_SCALE,
+                cache_size=cache_size,
+                expectimax=bool(EXPECTIMAX))
         # actions list, used with lookahead
         actions = []
+        # search tree, kept between pieces with ANYTIME
+        t = None
+        # background search, with WORKER or PARALLEL
+        worker = None
+        # the predicted state after the current piece is placed, and the plan being searched for it in the background
+        prefetch = None
+        # number of prefetched plans that were used, and that were abandoned because the state wasn't the predicted one
+        prefetch_hits = prefetch_misses = 0
         # performance limits for the tree search, which will be reduced when the algorithm becomes too slow to keep up
         # each limit is applied to the respective depth level (from 0 to 3)
-        # the limit (length of performance_caps) can't be greater than 4 (yet), since the pieces are unknown beyond that point (may be possible with FLEX_PIECE from TetrisDomain, but it's not implemented yet)
+        # the limit (length of performance_caps) can't be greater than 4, since the pieces are unknown beyond that point (with EXPECTIMAX, the states of the last level are evaluated over every possible piece)
         performance_caps = [3, 3, 3, 3]
-        perf = len(performance_caps)
+        budget = BudgetController(performance_caps)
         while True:
             try:
-                state = json.loads(
+                state = decoder.decode(
                     await websocket.recv()
                 )  # receive game update, this must be called timely or your game will get out of sync with the server
 
@@ -104,19 +150,19 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                     piece_n += 1
 
                 # if the decided move hasnt been made yet
-                elif prev_game is None or prev_game != state["game"]:
-                    prev_game = state["game"]
+                elif prev_game is None or prev_game != board(state):
+                    prev_game = board(state)
 
                     tstate = TetrisState.fromstate(state)
 
-                    # Populate rotations first
+                    # Populate rotations first. They are precomputed when the dimensions are received, so this only probes unknown pieces
                     abnormal = False
                     curr_piece = None if not Bot.contains_rotation(tstate.piece) else tstate.piece
                     while curr_piece is None or tstate.piece!=curr_piece:
                         Bot.register_rotation(tstate.piece, state["piece"])
 
                         key = 'w'
-                        if prev_game != state["game"]:
+                        if prev_game != board(state):
                             break
                         await websocket.send(
                             json.dumps({"cmd": "key", "key": key})
@@ -124,7 +170,7 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                         
                         await asyncio.sleep(1/(state["game_speed"]-1))
                         
-                        state = json.loads(
+                        state = decoder.decode(
                             await websocket.recv()
                         )
                         if not state["piece"]:
@@ -139,45 +185,64 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                     logger.debug("Rotations for %s: %s", tstate.piece, Bot.get_rotations(tstate.piece))
 
                     # Comment to reuse already calculated actions (will be less optimal, but less intensive)
-                    if not actions:
+                    # latency of the search for this piece, if there is one
+                    time = None
+                    if not actions or ANYTIME:
                         time = tm.time()
                         # The goal is the same because of how a node satisfies the goal condition in TetrisDomain, at the moment.
                         # Currently, we simply want the solution to be a state such that its size is smaller than the initial state (lower number of lines).
                         tgoal = TetrisState.fromstate(state)
                         problem = SearchProblem(tetris, tstate, tgoal)
                         # The time cap means that the search can take at most 3 frames to complete
-                        t = SearchTree(problem, pcaps=performance_caps, time_cap=3/(state["game_speed"]))
-                        
-                        t.search()
+                        time_cap = budget.time_cap(state["game_speed"])
+                        if WORKER or PARALLEL:
+                            if worker is None and PARALLEL:
+                                worker = ParallelSearch(tetris, int(PARALLEL) or None, anytime=bool(ANYTIME))
+                            elif worker is None:
+                                worker = SearchWorker(tetris, anytime=bool(ANYTIME))
+                            # The next piece may have been planned while the current one was falling
+                            if prefetch and prefetch[0].game == tstate.game and prefetch[0].piece == tstate.piece:
+                                plan = prefetch[1]
+                                prefetch_hits += 1
+                            else:
+                                # The search for the wrong state is stopped, instead of delaying this one until it runs out of time
+                                if prefetch:
+                                    worker.abandon(prefetch[1])
+                                    prefetch_misses += 1
+                                plan = worker.plan(tstate, performance_caps, time_cap)
+                            prefetch = None
+                            state = await receive_until(websocket, decoder, plan, state)
+                            actions = plan.result()
+                            time = tm.time() - time
+                            logger.debug("Plan: %s", actions)
+
+                            # The piece was placed while planning
+                            if not state["piece"] or prev_game != board(state):
+                                actions = []
+                                continue
+                        elif ANYTIME:
+                            # Reuse the tree of the previous piece, if it was placed as planned
+                            if t is None or not t.reroot(problem):
+                                t = SearchTree(problem, pcaps=performance_caps, time_cap=time_cap)
+                            t.time_cap = time_cap
+                            t.search_anytime()
+                        else:
+                            t = SearchTree(problem, pcaps=performance_caps, time_cap=time_cap)
+                            t.search()
 
-                        logger.debug("Plan: %s", t.plan)
-                        logger.debug("Average branching: %s", t.avg_branching)
+                        if not worker:
+                            logger.debug("Plan: %s", t.plan)
+                            logger.debug("Average branching: %s", t.avg_branching)
+                            logger.debug("Nodes: %s", t.memory_stats)
 
-                        node_final = t.solution
-                        logger.debug("Cost: %s", node_final.cost)
-                        logger.debug("Heuristic: %s", node_final.heuristic)
-                        actions = t.plan
-                        time = tm.time() - time
+                            node_final = t.solution
+                            logger.debug("Cost: %s", node_final.cost)
+                            logger.debug("Heuristic: %s", node_final.heuristic)
+                            actions = t.plan
+                            time = tm.time() - time
 
-                    max_height = min(j[1] for j in state["game"]) if state["game"] != [] else 0 
-
-                    tempo = time*state["game_speed"]
-                    # print(time)
-                    if tempo+25 < max_height:
-                        if performance_caps[-1] < 3:
-                            performance_caps[-1] += 1
-                            # print("adding performance -> {}".format(performance_caps))
-                        else:
-                            if len(performance_caps) < perf:
-                                performance_caps.append(1)
-                    elif tempo+8 > max_height:
-                        if performance_caps[-1] > 1:
-                            performance_caps[-1] -= 1
-                            # print("subtrating performance -> {}".format(performance_caps))
-                        else:
-                            if len(performance_caps) > 1: 
-                                performance_caps.pop()
-                    time = 0
+                    # Adjust the performance caps, with the latency of the searches and the space above the stack
+                    budget.update(state, time)
 
                     action_r, action_t = actions.pop(0)
                     
@@ -188,9 +253,14 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                     logger.debug("Translations: %s",action_t)
                     logger.debug("Decided move path: %s",decided_move_path)
 
+                    # The placement is decided, so the next piece can be planned in the background while this one falls
+                    if worker and (not actions or ANYTIME):
+                        predicted = tetris.result(tstate, (action_r, action_t))
+                        prefetch = (predicted, worker.plan(predicted, performance_caps, budget.time_cap(state["game_speed"])))
+
                     for key in decided_move_path:
                         prev_piece = state["piece"]
-                        if prev_game != state["game"]:
+                        if prev_game != board(state):
                             break
                         await websocket.send(
                             json.dumps({"cmd": "key", "key": key})
@@ -198,7 +268,7 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
                         await asyncio.sleep(1/state["game_speed"])
                         # Sometimes the 'game.py' is not fast enough to register all inputs, we want to make sure it does register them all
                         while Bot.no_action(prev_piece, state["piece"]):
-                            state = json.loads(
+                            state = decoder.decode(
                                     await websocket.recv()
                             )
 
@@ -208,42 +278,30 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
             except websockets.exceptions.ConnectionClosedOK:
                 
                 logger.debug("Server has cleanly disconnected us")
+                if worker:
+                    worker.shutdown()
                 if OUT:
                     f = open(OUT, 'w')
                     f.write(str(state["score"]))
                     f.close()
+                logger.info("Search latencies:\n%s", budget)
+                if prefetch_hits or prefetch_misses:
+                    logger.info("Prefetched plans: %d used, %d abandoned (%.0f%% hit rate)",
+                        prefetch_hits, prefetch_misses, 100*prefetch_hits/(prefetch_hits+prefetch_misses))
                 logger.info("""
                 Cache sizes:
                     Cached games clears: %s
-                    Cached games clears hits: %s
-                    Cached actions: %s
-                    Cached actions hits: %s
                     Cached heuristic: %s
-                    Cached heuristic hits: %s
+                    Cached chance: %s
+                    Known actions: %s
                 Bank sizes:
-                    TetrisObject bank pos: %s
-                    Game bank pos: %s
-                    Game bank sqs: %s
-                    Game bank lines: %s
-                    Piece bank pos: %s
-                    Piece bank sqs: %s
-                    Piece bank lines: %s
-                    Piece bank falls: %s
+%s
                 """,
-                    len(tetris.cached_games_clears),
-                    tetris.stats["cached_games_clears_hits"],
-                    len(tetris.cached_actions),
-                    tetris.stats["cached_actions_hits"],
-                    len(tetris.cached_heuristic),
-                    tetris.stats["cached_heuristic_hits"],
-                    len(TetrisObject.bank_lines_from_pos),
-                    len(Game.bank_lines_from_pos),
-                    len(Game.bank_game_sqs),
-                    len(Game.bank_game_lines),
-                    len(Piece.bank_lines_from_pos),
-                    len(Piece.bank_piece_sqs),
-                    len(Piece.bank_piece_lines),
-                    len(Piece.bank_falls))
+                    tetris.cached_games_clears,
+                    tetris.cached_heuristic,
+                    tetris.cached_chance,
+                    len(Bot.known_actions),
+                    '\n'.join( "                    {0}: {1}".format(name, cache) for name, cache in Bot.caches().items() ))
                 return
 
             # Next line is not needed for AI agent
@@ -6,6 +6,8 @@ import os
 import requests
 import websockets
 
+from protocol import Decoder, MODES
+
 def getCubes(game):
     cubes = []
     for piece in game:
@@ -13,21 +15,22 @@ def getCubes(game):
     return cubes
 	
 
-async def messages_handler(websocket_path, queue):
-    """Handles server side messages, putting them into a queue."""
+async def messages_handler(websocket_path, queue, mode="full"):
+    """Handles server side messages, putting them (decoded) into a queue."""
     async with websockets.connect(websocket_path) as websocket:
-        await websocket.send(json.dumps({"cmd": "join"}))
+        await websocket.send(json.dumps({"cmd": "join", "mode": mode}))
+        decoder = Decoder(mode)
 
         while True:
             update = await websocket.recv()
-            queue.put_nowait(update)
+            queue.put_nowait(decoder.decode(update))
 
 
 async def main_loop(queue):
     """Processes events from server and display's."""
 
     state = await queue.get()  # first state message includes map information
-    newgame_json = json.loads(state)
+    newgame_json = state
     player_name = ""
 
 
@@ -41,7 +44,7 @@ async def main_loop(queue):
     while True:
 
         try:
-            state = json.loads(queue.get_nowait())
+            state = queue.get_nowait()
             if "score" in state:
                 score = state["score"]
 
@@ -93,6 +96,9 @@ if __name__ == "__main__":
         "--scale", help="reduce size of window by x times", type=int, default=1
     )
     parser.add_argument("--port", help="TCP port", type=int, default=PORT)
+    parser.add_argument(
+        "--mode", help="mode of the game states (see protocol.py)", choices=MODES, default="full"
+    )
 
     arguments = parser.parse_args()
     SCALE = arguments.scale
@@ -104,7 +110,7 @@ if __name__ == "__main__":
 
     try:
         LOOP.run_until_complete(
-            asyncio.gather(messages_handler(ws_path, q), main_loop(q))
+            asyncio.gather(messages_handler(ws_path, q, arguments.mode), main_loop(q))
         )
     except RuntimeError as err:
         pass
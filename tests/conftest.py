@@ -0,0 +1,43 @@
+import os
+import random
+import sys
+
+import pytest
+
+# The modules are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def search_states():
+    """States of the pieces of a few seeded simulated games."""
+    from simulator import play
+    from tree_search import TetrisDomain
+
+    states = []
+    for seed in (1, 2):
+        play(TetrisDomain(), seed, max_pieces=40, observer=states.append)
+    return states
+
+
+@pytest.fixture
+def play_random():
+    """Function that plays a seeded server Game with random keys.
+
+    play_random(seed, ticks=None, recorder=None, observer=None) plays for at most
+    'ticks' ticks, calling 'observer' with the game and the state of each tick,
+    and returns the game and the states of its ticks.
+    """
+    from game import Game, random_pieces
+
+    def play(seed, ticks=None, recorder=None, observer=None):
+        rng = random.Random(seed)
+        game = Game(pieces=random_pieces(random.Random(seed)), recorder=recorder)
+        states = []
+        while game.running and (ticks is None or game.ticks < ticks):
+            states.append(game.step(rng.choice(["a", "d", "w", "", ""])))
+            if observer is not None:
+                observer(game, states[-1])
+        return game, states
+
+    return play
@@ -0,0 +1,87 @@
+from collections import deque
+
+import pytest
+
+from bot import Bot
+from budget import BudgetController
+
+SPEED = 10
+
+
+@pytest.fixture(autouse=True)
+def dimensions():
+    Bot.update_dimensions(10, 30)
+
+
+def state(height=0, speed=SPEED):
+    """A server state whose stack is 'height' lines high, in the first column."""
+    return {"game": [[1, y] for y in range(Bot.y() - height, Bot.y())], "game_speed": speed}
+
+
+def test_margin_greater_than_headroom():
+    with pytest.raises(ValueError):
+        BudgetController([3, 3], margin=10, headroom=5)
+    BudgetController([3, 3], margin=5, headroom=5)
+
+
+def test_expected_latency_is_p90_of_window():
+    budget = BudgetController([3, 3])
+    for ms in range(1, 26):
+        budget.record(ms / 1000)
+    # Only the last 20 are kept, 6 to 25 ms, of which the 90th percentile is the 19th
+    assert list(budget.latencies[(3, 3)]) == [ms / 1000 for ms in range(6, 26)]
+    assert budget.expected_latency() == 0.024
+    # Each configuration has its own latencies
+    assert budget.expected_latency([3, 2]) == 0
+    budget.pcaps[:] = [3, 2]
+    budget.record(0.1)
+    assert budget.expected_latency() == 0.1
+    assert budget.expected_latency([3, 3]) == 0.024
+
+
+def test_grows_while_fast():
+    budget = BudgetController([3, 3, 2])
+    assert budget.update(state(), 0.1) == [3, 3, 3]
+    # The deepest and widest configuration can't grow
+    assert budget.update(state(), 0.1) == [3, 3, 3]
+
+
+def test_shrinks_when_slow():
+    budget = BudgetController([3, 3, 3])
+    # 2.5s is 25 frames, plus the margin of 8 is more than the 30 lines of an empty board
+    assert budget.update(state(), 2.5) == [3, 3, 2]
+    # The same latency is only slow enough to shrink when the stack is higher
+    budget = BudgetController([3, 3, 3])
+    assert budget.update(state(), 1.5) == [3, 3, 3]
+    assert budget.update(state(10), 1.5) == [3, 3, 2]
+
+
+def test_shrinks_shallower_at_width_one():
+    budget = BudgetController([3, 1])
+    assert budget.update(state(), 2.5) == [3]
+    assert budget.update(state(), 2.5) == [2]
+    assert budget.update(state(), 2.5) == [1]
+    assert budget.update(state(), 2.5) == [1]
+
+
+def test_does_not_grow_into_slow_configuration():
+    budget = BudgetController([3, 3, 2])
+    budget.latencies[(3, 3, 3)] = deque([2.5, 2.5], maxlen=budget.window)
+    assert budget.update(state(), 0.1) == [3, 3, 2]
+    # Its oldest latency is forgotten instead, so it's tried again once they're all forgotten
+    assert list(budget.latencies[(3, 3, 3)]) == [2.5]
+    assert budget.update(state(), 0.1) == [3, 3, 2]
+    assert not budget.latencies[(3, 3, 3)]
+    assert budget.update(state(), 0.1) == [3, 3, 3]
+
+
+def test_empty_board_is_full_height():
+    assert BudgetController.remaining_frames([]) == Bot.y()
+    assert BudgetController.remaining_frames(state(5)["game"]) == Bot.y() - 5
+
+    # The same in binary mode, where the board is "lines"
+    for height in (0, 5, 25):
+        full, binary = BudgetController([3, 3, 3]), BudgetController([3, 3, 3])
+        lines = {"lines": (1 << 7,) * height, "game_speed": SPEED}
+        assert full.update(state(height), 0.5) == binary.update(lines, 0.5)
+    assert full.pcaps == [3, 3, 2]
@@ -0,0 +1,93 @@
+import pytest
+
+from bot import Bot
+from cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["c"] = 3
+    assert "a" not in cache
+    assert list(cache.values()) == [2, 3]
+    assert cache.evictions == 1
+
+
+def test_lookups_refresh_entries():
+    cache = LRUCache(2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert "a" in cache and "b" not in cache
+
+    assert cache["a"] == 1
+    cache["d"] = 4
+    assert "a" in cache and "c" not in cache
+
+
+def test_setting_existing_key_refreshes_it():
+    cache = LRUCache(2)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["a"] = 10
+    cache["c"] = 3
+    assert cache.get("a") == 10
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_get_counts_hits_and_misses():
+    cache = LRUCache()
+    cache["a"] = 1
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", 0) == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+    # Only get() is counted
+    cache["a"]
+    "a" in cache
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_falsy_values_are_hits():
+    cache = LRUCache()
+    cache["a"] = None
+    assert cache.get("a", 1) is None
+    assert cache.hits == 1
+
+
+def test_resize_evicts_oldest():
+    cache = LRUCache(4)
+    for i in range(4):
+        cache[i] = i
+    cache.resize(2)
+    assert list(cache.values()) == [2, 3]
+    assert cache.evictions == 2
+
+
+def test_unbounded():
+    cache = LRUCache(None)
+    for i in range(1000):
+        cache[i] = i
+    assert len(cache) == 1000
+    assert cache.evictions == 0
+
+
+@pytest.fixture
+def bot_caches():
+    sizes = {name: cache.maxsize for name, cache in Bot.caches().items()}
+    yield Bot.caches()
+    for name, cache in Bot.caches().items():
+        cache.resize(sizes[name])
+
+
+def test_resize_caches(bot_caches):
+    for cache in bot_caches.values():
+        cache[object()] = None
+        cache[object()] = None
+    Bot.resize_caches(1)
+    for cache in bot_caches.values():
+        assert cache.maxsize == 1
+        assert len(cache) <= 1
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from game import TickScheduler
+
+SPEED = 4  # a period of 0.25s; the times in these tests are exact in binary
+
+
+class FakeClock:
+    """A clock that only moves when slept on (oversleeping by 'delay') or advanced by a test."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.delay = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.delay
+
+
+def scheduler(clock):
+    return TickScheduler(clock=clock, sleep=clock.sleep)
+
+
+def tick(scheduler, work=0.0, clock=None):
+    if clock is not None:
+        clock.now += work
+    return asyncio.run(scheduler.wait(SPEED))
+
+
+def test_deadlines_are_absolute():
+    clock = FakeClock()
+    ticks = scheduler(clock)
+    tick(ticks)
+    # The work between ticks is taken from the sleep, not added to the period
+    for work in (0.0625, 0.125, 0.1875):
+        assert tick(ticks, work, clock) == 0
+    assert clock.sleeps == [0.25, 0.1875, 0.125, 0.0625]
+    assert clock.now == 101.0
+    assert ticks.overruns == 0 and ticks.ticks == 4
+
+
+def test_late_tick_is_an_overrun():
+    clock = FakeClock()
+    ticks = scheduler(clock)
+    tick(ticks)
+    assert tick(ticks, 0.375, clock) == 0.125
+    assert ticks.overruns == 1
+    assert ticks.max_lateness == 0.125
+    # Less than a period late, so the next deadline is still on schedule
+    assert tick(ticks) == 0
+    assert clock.now == 100.75
+
+
+def test_very_late_tick_resets_the_schedule():
+    clock = FakeClock()
+    ticks = scheduler(clock)
+    tick(ticks)
+    assert tick(ticks, 1.0, clock) == 0.75
+    assert ticks.overruns == 1
+    # The following ticks are a period apart from the late one, not rushed to catch up
+    assert tick(ticks) == 0
+    assert tick(ticks) == 0
+    assert clock.sleeps[-2:] == [0.25, 0.25]
+    assert ticks.overruns == 1
+
+
+def test_oversleeping_is_lateness():
+    clock = FakeClock()
+    clock.delay = 0.0625
+    ticks = scheduler(clock)
+    for _ in range(4):
+        assert tick(ticks) == 0.0625
+    assert ticks.overruns == 0
+    assert ticks.percentile(50) == 0.0625
+    assert ticks.stats()["mean"] == pytest.approx(0.0625)
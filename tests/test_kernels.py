@@ -0,0 +1,84 @@
+import pytest
+
+import kernels
+from bot import Bot, Game, Piece
+
+compiled = pytest.mark.skipif(not kernels.COMPILED, reason="the compiled kernels aren't built (cythonize -i _kernels.pyx)")
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    Bot.update_dimensions(10, 30)
+    return kernels.corpus(5000)
+
+
+def original_fall(game, piece, x, bot_heights):
+    """Piece.fall() as it was before the kernels, for the rotated 'piece' at 'x'."""
+    top_heights = game.skyline()[x-1:x+piece.width-1]
+    fall_height = min(top-bot for top, bot in zip(top_heights, bot_heights))
+    height_idx = Bot.y() - (fall_height + piece.size()) + 1
+    newlines = list(game.lines)
+
+    shifted_lines_idx = 0
+    shifted_lines = tuple( l<<(game.width - piece.width - x + 1) for l in piece.lines )
+
+    for line_idx in range(height_idx, game.size()):
+        newlines[-line_idx-1] |= shifted_lines[-shifted_lines_idx-1]
+        shifted_lines_idx += 1
+        if not shifted_lines_idx < piece.size():
+            break
+    for line_idx in range(shifted_lines_idx, piece.size()):
+        newlines[:0] = [shifted_lines[-line_idx-1]]
+
+    columns = list(game.columns())
+    for idx, column in enumerate(piece.columns()):
+        columns[x-1+idx] |= column << height_idx
+
+    return tuple(newlines), tuple(columns)
+
+
+def original_clear(game):
+    """Game.clear() as it was before the kernels, without the resulting Game."""
+    newlines = tuple(l for l in game.lines if l!=Bot.full_line)
+    columns = game.columns()
+    for k in range(game.size()-1, -1, -1):
+        if game.lines[-k-1] == Bot.full_line:
+            low = (1 << k) - 1
+            columns = tuple( (c & low) | ((c >> (k+1)) << k) for c in columns )
+    return newlines, columns
+
+
+def test_python_kernels_match_original(corpus):
+    for args in corpus:
+        lines, columns, _, piece_lines, _, bottom, x, _ = args
+        game = Game.fromlines(lines, columns)
+        expected = original_fall(game, Piece.fromlines(piece_lines), x, bottom)
+        assert kernels.python_fall(*args) == expected
+        assert kernels.python_clear(*expected, Bot.full_line) == original_clear(Game.fromlines(*expected))
+
+
+@compiled
+def test_fall_matches_python(corpus):
+    for args in corpus:
+        assert kernels.fall(*args) == kernels.python_fall(*args)
+
+
+@compiled
+def test_clear_matches_python(corpus):
+    for args in corpus:
+        lines, columns = kernels.python_fall(*args)
+        assert kernels.clear(lines, columns, Bot.full_line) == kernels.python_clear(lines, columns, Bot.full_line)
+
+
+def test_boards_too_large_to_compile(corpus):
+    # 70 lines, with the first column filled and a full line at the bottom, of a grid 100 lines high
+    height, size, width = 100, 70, 8
+    lines = (1 << width-1,)*(size-1) + (Bot.full_line,)
+    columns = ((1 << size) - 1,) + (1,)*(width-1)
+    skyline = (height-size,) + (height-1,)*(width-1)
+    for _, _, _, piece_lines, piece_columns, bottom, x, _ in corpus[:50]:
+        args = (lines, columns, skyline, piece_lines, piece_columns, bottom, x, height)
+        newlines, newcolumns = kernels.fall(*args)
+        assert (newlines, newcolumns) == kernels.python_fall(*args)
+        assert len(newlines) >= size
+        assert kernels.clear(newlines, newcolumns, Bot.full_line) == kernels.python_clear(newlines, newcolumns, Bot.full_line)
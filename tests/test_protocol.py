@@ -0,0 +1,127 @@
+import pytest
+
+import protocol
+from bot import Bot, TetrisObject, TetrisState
+from game import Game
+
+
+@pytest.fixture
+def game_states(play_random):
+    def game_states(ticks, seed=1):
+        """States of a seeded game played with random keys, as the server sends them."""
+        _, states = play_random(seed, ticks)
+        for state in states:
+            state["player"] = "player"
+        return states
+
+    return game_states
+
+
+@pytest.fixture
+def binary_messages(play_random):
+    def binary_messages(ticks, seed=1):
+        """States of a seeded game played with random keys, and their binary messages."""
+        messages = []
+
+        def encode(game, state):
+            state["player"] = "player"
+            # Encoded at its tick, the game changes in the next one
+            messages.append(protocol.encode_binary(state, game))
+
+        _, states = play_random(seed, ticks, observer=encode)
+        return states, messages
+
+    return binary_messages
+
+
+def cells(state):
+    """The state with its pieces and board as sorted lists of cells, the order they are sent in depends on the mode."""
+    def sort(positions):
+        return None if positions is None else sorted(map(list, positions))
+
+    return dict(
+        state,
+        game=sort(state["game"]),
+        piece=sort(state["piece"]),
+        next_pieces=[sort(piece) for piece in state["next_pieces"]],
+    )
+
+
+def full(states):
+    """The states as decoded in full mode."""
+    decoder = protocol.Decoder("full")
+    return [decoder.decode(protocol.encode(state)) for state in states]
+
+
+@pytest.mark.parametrize("interval", [protocol.KEYFRAME_INTERVAL, 7])
+def test_delta_matches_full(interval, game_states):
+    states = game_states(2 * protocol.KEYFRAME_INTERVAL + 50)
+    assert len(states) > 2 * interval
+
+    encoder = protocol.DeltaEncoder(interval)
+    frames = [encoder.encode(state) for state in states]
+    keyframes = [tick for tick, frame in enumerate(frames) if frame.get("keyframe")]
+    assert keyframes == list(range(0, len(states), interval))
+    # Delta frames leave out what didn't change
+    assert any("game" not in frame for frame in frames)
+
+    decoder = protocol.Decoder("delta")
+    decoded = [dict(decoder.decode(protocol.encode(frame))) for frame in frames]
+    assert decoded == full(states)
+
+
+def test_forced_keyframe(game_states):
+    states = game_states(30)
+    encoder = protocol.DeltaEncoder()
+    frames = []
+    for tick, state in enumerate(states):
+        if tick == 15:
+            encoder.keyframe()
+        frames.append(encoder.encode(state))
+    assert frames[15]["keyframe"]
+
+    # A client that joins at the keyframe gets the same states
+    decoder = protocol.Decoder("delta")
+    decoded = [dict(decoder.decode(protocol.encode(frame))) for frame in frames[15:]]
+    assert decoded == full(states[15:])
+
+
+def test_binary_matches_full(binary_messages):
+    states, messages = binary_messages(2 * protocol.KEYFRAME_INTERVAL)
+    assert all(isinstance(message, bytes) for message in messages)
+
+    decoder = protocol.Decoder("binary")
+    decoded = [decoder.decode(message) for message in messages]
+    assert any(state["lines"] for state in decoded)
+    assert [cells({key: value for key, value in state.items() if key != "lines"}) for state in decoded] == [
+        cells(state) for state in full(states)
+    ]
+
+
+def test_binary_lines_are_the_bot_lines(binary_messages):
+    Bot.update_dimensions(10, 30)
+    states, messages = binary_messages(2 * protocol.KEYFRAME_INTERVAL)
+
+    decoder = protocol.Decoder("binary", positions=False)
+    for state, message in zip(full(states), messages):
+        decoded = decoder.decode(message)
+        assert "game" not in decoded
+        assert decoded["lines"] == TetrisObject.lines_from_pos(state["game"], Bot.x() - 2)
+
+        if state["piece"] is not None:
+            binary, whole = TetrisState.fromstate(decoded), TetrisState.fromstate(state)
+            assert binary.game is whole.game
+            assert binary.piece == whole.piece
+            assert binary.next_pieces == whole.next_pieces
+
+
+@pytest.mark.parametrize("mode", ["delta", "binary"])
+def test_messages_without_piece_are_whole(mode):
+    info = Game().info()
+    decoder = protocol.Decoder(mode)
+    assert decoder.decode(protocol.encode(info)) == protocol.decode(protocol.encode(info))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        protocol.Decoder("xml")
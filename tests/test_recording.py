@@ -0,0 +1,48 @@
+import pytest
+
+import recording
+from recording import GameRecorder
+
+
+@pytest.fixture
+def play(play_random):
+    def play(path, seed, ticks=None):
+        """Play a seeded game with random keys, recording it to 'path'."""
+        recorder = GameRecorder(str(path), seed, "player", (10, 30))
+        game, states = play_random(seed, ticks, recorder=recorder)
+        if not game.running:
+            recorder.close(game.score, game.ticks)
+        return game, states
+
+    return play
+
+
+def test_replay_matches_game(tmp_path, play):
+    path = tmp_path / "game.jsonl"
+    game, states = play(path, seed=3)
+
+    replayed = list(recording.replay(str(path)))
+    assert [tick for tick, _ in replayed] == list(range(1, game.ticks + 1))
+    assert [state for _, state in replayed] == states
+
+    header, _, _, result = recording.load(str(path))
+    assert header["seed"] == 3
+    assert result == {"score": game.score, "ticks": game.ticks}
+
+
+def test_replay_of_unfinished_game(tmp_path, play):
+    path = tmp_path / "game.jsonl"
+    _, states = play(path, seed=5, ticks=40)
+
+    replayed = [state for _, state in recording.replay(str(path))]
+    assert recording.load(str(path))[3] is None
+    # The recording stops at its last piece, which is a few pieces ahead of the game
+    assert replayed[:len(states)] == states
+    assert recording.state_at(str(path), 20) == states[19]
+
+
+def test_recordings_are_never_overwritten(tmp_path):
+    path = tmp_path / "game.jsonl"
+    GameRecorder(str(path), 1, "player", (10, 30)).close(0, 0)
+    with pytest.raises(FileExistsError):
+        GameRecorder(str(path), 1, "player", (10, 30))
@@ -0,0 +1,227 @@
+import pytest
+
+import tree_search
+from bot import Bot, Game, TetrisState
+from tree_search import SearchProblem, SearchTree, TetrisDomain
+
+PCAPS = [3, 3, 3, 3]
+
+
+def sorted_list_search(tree):
+    """The search as it was, re-sorting the whole list of open nodes after each expansion. Returns the plan."""
+    open_nodes = [tree.root]
+    lowest = (tree.root, None)
+    while open_nodes:
+        node = open_nodes.pop(0)
+        if tree.problem.goal_test(node.state):
+            return node.pre_actions()
+        if node.depth >= tree.limit:
+            continue
+        children = tree.expand(node)
+        for child in children:
+            if lowest[1] is None or tree.node_order(child)[1] < lowest[1]:
+                lowest = (child, child.cost + child.heuristic)
+        open_nodes.extend(children)
+        open_nodes = sorted(open_nodes, key=tree.node_order)
+        for pruned in open_nodes[tree.pcaps[node.depth]:]:
+            tree.forget(pruned)
+        open_nodes = open_nodes[:tree.pcaps[node.depth]]
+    return lowest[0].pre_actions()
+
+
+def tree(domain, state, pcaps=PCAPS):
+    return SearchTree(SearchProblem(domain, state, state), pcaps=list(pcaps), time_cap=float("inf"))
+
+
+def test_frontier_matches_sorted_list(search_states):
+    domain = TetrisDomain()
+    for pcaps in (PCAPS, [5, 4, 3, 2], [1, 1, 1, 1]):
+        for state in search_states:
+            searched = tree(domain, state, pcaps)
+            searched.search()
+            assert searched.plan == sorted_list_search(tree(domain, state, pcaps))
+            assert searched.memory_stats["peak_open"] <= max(pcaps)
+
+
+class WithoutTranspositions(SearchTree):
+    def transposed(self, state, cost, depth):
+        return False
+
+
+def test_transpositions():
+    Bot.update_dimensions(10, 30)
+    o_piece, i_piece = Bot.spawn_pieces[3], Bot.spawn_pieces[2]
+    # Two O pieces placed side by side, in either order, give the same board
+    state = TetrisState(Game.fromlines((0b11000000,)), o_piece, [o_piece, i_piece])
+    domain = TetrisDomain()
+    pcaps = [9, 9, 9]
+
+    searched = tree(domain, state, pcaps)
+    searched.search()
+    reference = WithoutTranspositions(SearchProblem(domain, state, state), pcaps=list(pcaps), time_cap=float("inf"))
+    reference.search()
+
+    assert searched.transposition_hits > 0
+    assert searched.plan == reference.plan
+    assert searched.memory_stats["created"] < reference.memory_stats["created"]
+
+
+class RecordingExpansions(SearchTree):
+    def expand(self, node):
+        self.expanded.add(node)
+        return super().expand(node)
+
+
+def test_pruned_states_can_be_reached_again(search_states):
+    domain = TetrisDomain()
+    for state in search_states:
+        searched = RecordingExpansions(SearchProblem(domain, state, state), pcaps=list(PCAPS), time_cap=float("inf"))
+        searched.expanded = set()
+        searched.search()
+        # Only the nodes that are open or expanded are in the table
+        open_nodes = { entry[-1] for bucket in searched.open_nodes.buckets.values() for entry in bucket }
+        for node in searched.transpositions.values():
+            assert node in open_nodes or node in searched.expanded or node.depth >= searched.limit or node is searched.solution
+
+
+def anytime_tree(domain, state, pcaps=PCAPS):
+    searched = tree(domain, state, pcaps)
+    searched.search_anytime()
+    return searched
+
+
+def planned_child(searched):
+    return next(child for child in searched.root.children if child.pre_action == searched.plan[0])
+
+
+def next_state(searched, piece):
+    """The state of the next piece if the first action of the plan is taken, with 'piece' revealed."""
+    child = planned_child(searched)
+    return TetrisState(child.state.game, child.state.piece, child.state.next_pieces + [piece])
+
+
+def subtree(node):
+    nodes = [node]
+    for child in node.children or []:
+        nodes += subtree(child)
+    return nodes
+
+
+def test_children_are_only_kept_by_anytime_search(search_states):
+    domain = TetrisDomain()
+    searched = tree(domain, search_states[0])
+    searched.search()
+    assert searched.root.children is None
+    assert anytime_tree(domain, search_states[0]).root.children
+
+
+def test_anytime_plan(search_states):
+    domain = TetrisDomain()
+    for state in search_states:
+        searched = tree(domain, state)
+        searched.search()
+        assert anytime_tree(domain, state).plan == searched.plan
+
+
+def test_deepest_completed_iteration_is_kept(search_states, monkeypatch):
+    import tree_search
+
+    clock = [0]
+    monkeypatch.setattr(tree_search, "time", lambda: clock[0])
+
+    class TimedOut(SearchTree):
+        def search(self, deadline=None):
+            # The deadline passes during the iteration that would have been the last one
+            if self.limit == last:
+                clock[0] = deadline + 1
+            return super().search(deadline)
+
+    domain = TetrisDomain()
+    timed_out = 0
+    for state in search_states:
+        clock[0] = 0
+        last = anytime_tree(domain, state).limit
+        if last == 1:
+            continue
+        searched = TimedOut(SearchProblem(domain, state, state), pcaps=list(PCAPS), time_cap=1)
+        searched.search_anytime()
+        assert searched.limit == last
+        assert searched.plan == anytime_tree(domain, state, PCAPS[:last-1]).plan
+        timed_out += 1
+    assert timed_out
+
+
+def test_reroot(search_states):
+    domain = TetrisDomain()
+    state = search_states[0]
+    searched = anytime_tree(domain, state)
+    root = searched.root
+    child = planned_child(searched)
+    costs = { node: node.cost for node in subtree(child) }
+    grandchildren = child.children
+
+    # A state that isn't reached by any of the root's actions leaves the tree unchanged
+    assert not searched.reroot(SearchProblem(domain, state, state))
+    assert searched.root is root
+
+    new = next_state(searched, state.piece)
+    assert searched.reroot(SearchProblem(domain, new, new))
+    assert searched.root is child
+    assert child.parent is None and child.state is new
+    assert child.cost == 0 and child.depth == 0
+    # The children are reused, with the pieces revealed since and their costs and depths relative to the new root
+    assert child.children is grandchildren
+    for node in subtree(child):
+        assert node.cost == costs[node] - costs[child]
+        for grandchild in node.children or []:
+            assert grandchild.depth == node.depth + 1
+            assert grandchild.state.piece == ([new.piece] + new.next_pieces)[grandchild.depth]
+    assert searched.transpositions.get(searched.transposition_key(new)) is child
+
+    fresh = anytime_tree(domain, new)
+    expansions = searched.expansions
+    searched.search_anytime()
+    assert searched.plan == fresh.plan
+    assert searched.expansions - expansions < fresh.expansions
+
+
+def test_reroot_resets_children_of_unknown_pieces(search_states):
+    domain = TetrisDomain()
+    state = search_states[0]
+    # The nodes at the last depth have an unknown piece (FLEX_PIECE), and no children
+    pcaps = [3] * (len(state.next_pieces) + 2)
+    searched = anytime_tree(domain, state, pcaps)
+    flex = [node for node in subtree(planned_child(searched)) if node.depth == len(pcaps) - 1 and node.children is not None]
+    assert flex and all(node.state.piece is domain.FLEX_PIECE and node.children == [] for node in flex)
+
+    new = next_state(searched, state.piece)
+    assert searched.reroot(SearchProblem(domain, new, new))
+    for node in flex:
+        assert node.state.piece == state.piece
+        assert node.children is None
+
+
+def heuristic_corpus(domain, states):
+    """The states of the placements of each piece of 'states', and their games with the piece unknown."""
+    children = [ domain.result(state, action) for state in states for action in domain.actions(state) ]
+    return children + [ TetrisState(child.game, domain.FLEX_PIECE, []) for child in children[::50] ]
+
+
+@pytest.mark.parametrize("expectimax", [False, True])
+def test_heuristic_batch_matches_heuristic(search_states, expectimax):
+    pytest.importorskip("numpy")
+    corpus = heuristic_corpus(TetrisDomain(), search_states[:20])
+    goal = search_states[0]
+    # Separate domains, so that neither gets the heuristics cached by the other
+    domain = TetrisDomain(expectimax=expectimax)
+    expected = [ domain.heuristic(state, goal) for state in corpus ]
+    assert TetrisDomain(expectimax=expectimax).heuristic_batch(corpus, goal) == pytest.approx(expected)
+
+
+def test_heuristic_batch_without_numpy(search_states, monkeypatch):
+    monkeypatch.setattr(tree_search, "np", None)
+    corpus = heuristic_corpus(TetrisDomain(), search_states[:5])
+    goal = search_states[0]
+    domain = TetrisDomain()
+    expected = [ domain.heuristic(state, goal) for state in corpus ]
+    assert TetrisDomain().heuristic_batch(corpus, goal) == expected
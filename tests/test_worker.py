@@ -0,0 +1,32 @@
+import asyncio
+from time import time
+
+from bot import Bot, Game, TetrisState
+from tree_search import TetrisDomain
+from worker import SearchWorker
+
+
+def test_abandoned_search_does_not_delay_the_next(search_states):
+    Bot.update_dimensions(10, 30)
+    state, following = search_states[:2]
+    # The board can't get any smaller, so the search only stops at its time cap
+    empty = TetrisState(Game.fromlines(()), state.piece, state.next_pieces)
+
+    async def plans():
+        worker = SearchWorker(TetrisDomain())
+        try:
+            expected = await worker.plan(following, [3, 3, 3, 3], 10)
+            # A search of the whole tree, abandoned while it runs
+            stale = worker.plan(empty, [10**6] * 4, 30)
+            await asyncio.sleep(0.5)
+            worker.abandon(stale)
+            t = time()
+            plan = await worker.plan(following, [3, 3, 3, 3], 10)
+            return expected, plan, time() - t, stale.cancelled()
+        finally:
+            worker.shutdown()
+
+    expected, plan, latency, cancelled = asyncio.run(plans())
+    assert plan == expected
+    assert latency < 5
+    assert cancelled
@@ -11,12 +11,22 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.CRITICAL)
 
 from time import time
+from heapq import heapify, heappush, heappop, heappushpop
+from itertools import count
 
-from bot import Bot, TetrisState, Piece
+# NumPy is optional, used to evaluate the heuristic of many states at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bot import Bot, TetrisState, Piece, Game
+from cache import LRUCache, DEFAULT_MAXSIZE
 
 # General lambda functions
 avg = lambda l: sum(l)/len(l)
 variance = lambda l: sum( [(x-avg(l))**2 for x in l] )/(len(l)-1) if len(l)>1 else 0
+popcount = lambda i: bin(i).count('1')
 
 class TetrisDomain:
 
@@ -41,7 +51,26 @@ class TetrisDomain:
         CONTINUITY=15965,
         CENTER_SCALE=13238,
         HOLES_SCALE=22233,
-        CLEARED_LINES_SCALE=12438):
+        CLEARED_LINES_SCALE=12438,
+        cache_size=DEFAULT_MAXSIZE,
+        expectimax=False):
+
+        # The parameters as given, so that an equal domain can be created (in another process, for example)
+        self.params = {
+            "HOLES": HOLES,
+            "MAX_HEIGHT": MAX_HEIGHT,
+            "AVG_HEIGHT": AVG_HEIGHT,
+            "HEIGHT_VARIANCE": HEIGHT_VARIANCE,
+            "CLEARED_LINES": CLEARED_LINES,
+            "CONTINUITY": CONTINUITY,
+            "CENTER_SCALE": CENTER_SCALE,
+            "HOLES_SCALE": HOLES_SCALE,
+            "CLEARED_LINES_SCALE": CLEARED_LINES_SCALE,
+            "expectimax": expectimax
+        }
+        self.cache_size = cache_size
+        # Evaluate the states whose piece is unknown (FLEX_PIECE) as chance nodes, instead of only by their game
+        self.expectimax = expectimax
 
         # Heuristic parameters
         self.HOLES = HOLES
@@ -62,46 +91,33 @@ class TetrisDomain:
         # Piece that represents any piece (for lookahead of unknown pieces). It's equal to a null Piece, a Piece instance 'p' where bool(p)==False
         self.FLEX_PIECE = Piece()
         # Dictionary that functions as a cache, saves the resulting game from an unscored game (with lines to be cleared) and how much score it provides.
-        self.cached_games_clears = {}
-        # Save the possible actions for a piece
-        self.cached_actions = {}
+        self.cached_games_clears = LRUCache(cache_size)
         # Save the values for the heuristic given a game
-        self.cached_heuristic = {}
-        # Stats for analysis
-        self.stats = {
-            "cached_games_clears_hits": 0,
-            "cached_actions_hits": 0,
-            "cached_heuristic_hits": 0
-        }
+        self.cached_heuristic = LRUCache(cache_size)
+        # Save the expected values of chance nodes given a game, with expectimax
+        self.cached_chance = LRUCache(cache_size)
 
     def actions(self, state: TetrisState):
         piece = state.piece
 
-        if piece in self.cached_actions:
-            self.stats["cached_actions_hits"] += 1
-            return self.cached_actions[piece]
-
         if not Bot.contains_rotation(piece):
             return []
 
-        actions = []
-        r = 0
-        for rotation, pos in Bot.get_rotations(piece):
-            actions.extend([ (r,t-pos[0]) for t in range(1, Bot.x()-rotation.width) ])
-            r += 1
+        return Bot.get_actions(piece)
 
-        self.cached_actions[piece] = actions
-        return actions
+    def place(self, game: Game, piece: Piece, action) -> Tuple[Game, int]:
+        """Return the game after 'piece' is placed with 'action' and its lines are cleared, and the score obtained."""
+        game_before = piece.fall(game, action[0], action[1])
 
-    def result(self, state: TetrisState, action):
-        game_before = state.piece.fall(state.game, action[0], action[1])
-        
-        if game_before not in self.cached_games_clears:
+        cached = self.cached_games_clears.get(game_before)
+        if cached is None:
             game_final, clears = game_before.clear()
-            self.cached_games_clears[game_before] = (game_final, clears**2)
-        else:
-            self.stats["cached_games_clears_hits"] += 1
-            game_final = self.cached_games_clears[game_before][0]
+            cached = (game_final, clears**2)
+            self.cached_games_clears[game_before] = cached
+        return cached
+
+    def result(self, state: TetrisState, action):
+        game_final = self.place(state.game, state.piece, action)[0]
 
         next_pieces = state.next_pieces
         return TetrisState(game_final, next_pieces[0] if next_pieces else self.FLEX_PIECE, next_pieces[1:])
@@ -112,12 +128,17 @@ class TetrisDomain:
 
     # heuristic for the game
     def heuristic(self, state: TetrisState, goal: TetrisState):
-        if state.game in self.cached_heuristic:
-            self.stats["cached_heuristic_hits"] += 1
-            return self.cached_heuristic[state.game]
-        
-        heights = state.game.heights()
-        top_heights = [h[-1] for h in heights]
+        if self.expectimax and not state.piece:
+            return self.chance(state, goal)
+        heuristic = self.cached_heuristic.get(state.game)
+        if heuristic is None:
+            heuristic = self._heuristic(state, goal)
+            self.cached_heuristic[state.game] = heuristic
+        return heuristic
+
+    def _heuristic(self, state: TetrisState, goal: TetrisState):
+        columns = state.game.columns()
+        top_heights = state.game.skyline()
 
         weighted_top_heights = [ h*c for h,c in zip(top_heights, self.center_weight(state.game.width-1)) ]
 
@@ -130,8 +151,8 @@ class TetrisDomain:
         # Obtain the variance of the heights
         height_variance = variance(weighted_top_heights)
 
-        # Get holes (analyzed vertically)
-        holes = sum([ (sum([ x for x in self.next_differences(l[::-1]) ])-len(l)+1)**self.HOLES_SCALE for l in heights ])
+        # Get holes (analyzed vertically), the empty squares below the top of each column
+        holes = sum([ (c.bit_length()-popcount(c))**self.HOLES_SCALE for c in columns ])
 
         # Number of cleared lines
         cleared = (state.game.size()-goal.game.size())
@@ -139,7 +160,7 @@ class TetrisDomain:
         cleared = cleared**self.CLEARED_LINES_SCALE if cleared > 0 else -( (-cleared)**2 )
 
         # Analyze horizontal holes, if there isn't horizontal continuity. The lesser the continuity, the greater this value is
-        continuity = sum( len(set(heights[i]).symmetric_difference(set(heights[i+1]))) for i in range(state.game.width-1) )
+        continuity = sum( popcount(columns[i] ^ columns[i+1]) for i in range(state.game.width-1) )
 
         heuristic = \
             +holes*self.HOLES \
@@ -148,10 +169,124 @@ class TetrisDomain:
             +(Bot.y()-max_height)*self.MAX_HEIGHT \
             +(Bot.y()-avg_height)*self.AVG_HEIGHT \
             +height_variance*self.HEIGHT_VARIANCE
-        self.cached_heuristic[state.game] = heuristic
 
         return heuristic
 
+    def heuristic_batch(self, states: List[TetrisState], goal: TetrisState) -> List[float]:
+        """
+Return the heuristic of each state, such as all the children of a node.
+The states that aren't cached are evaluated together with heuristic_terms() if NumPy is available, or one by one with heuristic() otherwise.
+With expectimax, the states whose piece is unknown are evaluated with chance() instead.
+        """
+        if self.expectimax and any(not state.piece for state in states):
+            heuristics = self._heuristic_batch([ state for state in states if state.piece ], goal)
+            heuristics.reverse()
+            return [ heuristics.pop() if state.piece else self.chance(state, goal) for state in states ]
+        return self._heuristic_batch(states, goal)
+
+    def _heuristic_batch(self, states: List[TetrisState], goal: TetrisState) -> List[float]:
+        heuristics = []
+        missing = []
+        for idx, state in enumerate(states):
+            heuristics.append(self.cached_heuristic.get(state.game))
+            if heuristics[-1] is None:
+                missing.append(idx)
+
+        if np is None or len(missing) < 2:
+            for idx in missing:
+                heuristics[idx] = self._heuristic(states[idx], goal)
+                self.cached_heuristic[states[idx].game] = heuristics[idx]
+            return heuristics
+
+        games = [ states[idx].game for idx in missing ]
+        for idx, game, heuristic in zip(missing, games, self.heuristic_terms(games, goal)["heuristic"].tolist()):
+            heuristics[idx] = heuristic
+            self.cached_heuristic[game] = heuristic
+        return heuristics
+
+    def chance(self, state: TetrisState, goal: TetrisState) -> float:
+        """
+Expected value of a state whose piece is unknown: the average, over every piece that can spawn (Bot.spawn_pieces), of the lowest cost plus heuristic of its placements.
+The placements are only evaluated by their game, so the value only depends on the game and is cached by it.
+        """
+        value = self.cached_chance.get(state.game)
+        if value is None:
+            values = []
+            for piece in Bot.spawn_pieces:
+                children = []
+                costs = []
+                for a in self.actions(TetrisState(state.game, piece, [])):
+                    game, score = self.place(state.game, piece, a)
+                    children.append(TetrisState(game, self.FLEX_PIECE, []))
+                    costs.append(17 - score)
+                if not children:
+                    continue
+                heuristics = self._heuristic_batch(children, goal)
+                values.append(min( c + h for c, h in zip(costs, heuristics) ))
+            value = avg(values) if values else self._heuristic(state, goal)
+            self.cached_chance[state.game] = value
+        return value
+
+    def heuristic_terms(self, games: List[Game], goal: TetrisState) -> dict:
+        """
+Vectorized version of heuristic(), which requires NumPy.
+Return a dictionary with an array for each of the heuristic's terms, and the weighted total in "heuristic", with a value for each game.
+        """
+        width = Bot.x()-2
+        size = max([Bot.y()] + [ game.size() for game in games ])
+        # Each game is a row of its lines, aligned at the bottom
+        rows = np.zeros((len(games), size), dtype=np.uint32)
+        for idx, game in enumerate(games):
+            if game.lines:
+                rows[idx, size-game.size():] = game.lines
+        # Filled squares, indexed by game, line (from the top) and X
+        squares = (rows[:, :, None] >> np.arange(width-1, -1, -1, dtype=np.uint32)) & 1
+
+        filled = squares.any(axis=1)
+        # Height of the top square of each column above the bottom line, equivalent to bit_length() of Game.columns()
+        column_heights = np.where(filled, size - squares.argmax(axis=1), 0)
+        top_heights = Bot.y() - column_heights
+
+        weighted_top_heights = top_heights[:, :width-1] * np.array(self.center_weight(width-1))
+
+        # Get the top height
+        max_height = weighted_top_heights.min(axis=1)
+
+        # Get the average height
+        avg_height = weighted_top_heights.mean(axis=1)
+
+        # Obtain the variance of the heights
+        height_variance = weighted_top_heights.var(axis=1, ddof=1) if width-1 > 1 else np.zeros(len(games))
+
+        # Get holes (analyzed vertically), the empty squares below the top of each column
+        holes = ((column_heights - squares.sum(axis=1)).astype(float)**self.HOLES_SCALE).sum(axis=1)
+
+        # Number of cleared lines
+        cleared = np.array([ game.size() for game in games ]) - goal.game.size()
+        # Avoid creating a complex number
+        cleared = np.where(cleared > 0, np.maximum(cleared, 0)**self.CLEARED_LINES_SCALE, -(cleared**2))
+
+        # Analyze horizontal holes, if there isn't horizontal continuity. The lesser the continuity, the greater this value is
+        continuity = (squares[:, :, 1:] != squares[:, :, :-1]).sum(axis=(1, 2))
+
+        heuristic = \
+            +holes*self.HOLES \
+            +continuity*self.CONTINUITY \
+            +cleared*self.CLEARED_LINES \
+            +(Bot.y()-max_height)*self.MAX_HEIGHT \
+            +(Bot.y()-avg_height)*self.AVG_HEIGHT \
+            +height_variance*self.HEIGHT_VARIANCE
+
+        return {
+            "max_height": max_height,
+            "avg_height": avg_height,
+            "height_variance": height_variance,
+            "holes": holes,
+            "cleared": cleared,
+            "continuity": continuity,
+            "heuristic": heuristic
+        }
+
     def satisfies(self, state: TetrisState, goal: TetrisState):
         return len(state.next_pieces) < len(goal.next_pieces) and state.game.size() < goal.game.size()
 
@@ -172,6 +307,9 @@ class SearchProblem:
 
 
 class SearchNode:
+    # Thousands of nodes are created for each piece, slots make them smaller and faster to create
+    __slots__ = ("state", "parent", "depth", "cost", "heuristic", "pre_action", "children")
+
     def __init__(self,state,parent,cost=0,heuristic=0,pre_action=None): 
         self.state = state
         self.parent = parent
@@ -179,36 +317,126 @@ class SearchNode:
         self.cost = cost
         self.heuristic = heuristic
         self.pre_action = pre_action
+        # Child nodes, once this node has been expanded
+        self.children = None
 
     def __str__(self):
         return "no(" + str(self.state) + "," + str(self.parent) + ")"
     def __repr__(self):
         return str(self)
 
+    def path(self):
+        """The nodes from the root to this node."""
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
     def in_parent(self, state):
-        if self.parent is None:
-            return False
-        return True if self.parent.state==state else self.parent.in_parent(state)
+        node = self.parent
+        while node is not None:
+            if node.state==state:
+                return True
+            node = node.parent
+        return False
 
     def pre_actions(self):
-        return (self.parent.pre_actions() if self.parent else []) + ([self.pre_action] if self.pre_action is not None else [])
+        return [ node.pre_action for node in self.path() if node.pre_action is not None ]
+
+
+
+class Frontier:
+    """
+Open nodes of a SearchTree, in a heap for each depth.
+The keys of the heaps are negated, so each heap has its worst node on top, and the frontier is pruned to the best nodes by popping the worst ones.
+Ties between equal keys keep the order of insertion, the latest node being the worst.
+    """
+
+    def __init__(self, order):
+        self.order = order
+        self.insertions = count()
+        self.buckets = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def entry(self, node):
+        return tuple( -key for key in self.order(node) ) + (-next(self.insertions), node)
+
+    def worst(self) -> list:
+        """The heap with the worst node."""
+        return min( (bucket for bucket in self.buckets.values() if bucket), key=lambda bucket: bucket[0] )
+
+    def push(self, node):
+        heappush(self.buckets.setdefault(node.depth, []), self.entry(node))
+        self.size += 1
+
+    def push_bounded(self, node, size: int):
+        """Push 'node', keeping only the best 'size' nodes. Returns the node that was dropped, if any."""
+        entry = self.entry(node)
+        bucket = self.buckets.setdefault(node.depth, [])
+        if self.size < size:
+            heappush(bucket, entry)
+            self.size += 1
+            return None
+        if size <= 0:
+            return node
+        worst = self.worst()
+        if worst is bucket:
+            return heappushpop(bucket, entry)[-1]
+        if entry > worst[0]:
+            heappush(bucket, entry)
+            return heappop(worst)[-1]
+        return node
+
+    def prune(self, size: int) -> list:
+        """Keep only the best 'size' nodes. Returns the nodes that were dropped."""
+        dropped = []
+        while self.size > size:
+            dropped.append(heappop(self.worst())[-1])
+            self.size -= 1
+        return dropped
+
+    def pop(self):
+        """Remove and return the best node. The heaps are only as large as the performance caps, so it's found by scanning their tops and leaves."""
+        bucket = max( (bucket for bucket in self.buckets.values() if bucket), key=max )
+        entry = max(bucket)
+        bucket.remove(entry)
+        heapify(bucket)
+        self.size -= 1
+        return entry[-1]
 
 
 
 class SearchTree:
 
-    def __init__(self,problem,pcaps: List[int] = [5,5,5,5],time_cap: float=1): 
+    def __init__(self,problem,pcaps: List[int] = [5,5,5,5],time_cap: float=1,root_actions: List[Tuple[int]]=None): 
         self.problem = problem
         root = SearchNode(problem.initial, None)
-        self.open_nodes = [root]
+        self.root = root
+        # Top priority to node cost, then to A* cost
+        self.node_order = lambda x: (x.cost, x.cost + x.heuristic)
+        # The open nodes, pruned to the best 'pcaps[depth]' after expanding a node at 'depth'
+        self.open_nodes = Frontier(self.node_order)
+        self.open_nodes.push(root)
+        # Transposition table, with the node that reached each state at the lowest cost and depth, while it's open or expanded. Identical states reached by different placement orders are only expanded once
+        self.transpositions = LRUCache(problem.domain.cache_size)
+        self.transposition_hits = 0
+        self.transpose(root)
         self.solution = None
         self.terminals = 0
         self.non_terminals = 0
+        # Nodes whose children have been generated (non_terminals also counts the nodes at the depth limit, which aren't expanded)
+        self.expansions = 0
         self.avg_branching = 0
         self.average_depth = 0
         self.plan = []
-        # Top priority to node cost, then to A* cost
-        self.node_order = lambda x: (x.cost, x.cost + x.heuristic)
+        # How the last search was terminated
+        self.method = None
         # In case a solution hasn't been found yet. Only returns this as a solution if 'best_effort' is True
         self.lowest_astar_node = (root, None)
         # The maximum number of nodes that are expanded (prunning), for each depth level
@@ -216,65 +444,202 @@ class SearchTree:
         self.limit = len(self.pcaps)
         # Set a limit to the time the tree search takes. Once the limit is broken, the result will be best-effort
         self.time_cap = time_cap
+        # If given, only these actions of the root are searched (the root's actions are split between searches in parallel)
+        self.root_actions = None if root_actions is None else set(root_actions)
+        # Whether the expanded nodes keep their children, to be reused by the next iterations and after rerooting (only in the anytime search, otherwise the whole tree would stay in memory)
+        self.keep_children = False
+        # If given, the search is stopped as if the time cap had been reached once it returns True (for example, when a background search is no longer needed)
+        self.cancelled = None
         self.time_stats = {
             "result": 0,
             "actions": 0,
             "cost/heuristic": 0,
             "total": 0
         }
+        # Number of nodes in the tree, nodes created in total (including those discarded when rerooting) and the maximum number of open nodes at once
+        self.memory_stats = {
+            "nodes": 1,
+            "created": 1,
+            "peak_open": 1
+        }
 
     def get_path(self, node):
-        if node.parent == None:
-            return [node.state]
-        path = self.get_path(node.parent)
-        path += [node.state]
-        return(path)
-
-    def search(self):
+        return [ n.state for n in node.path() ]
+
+    @staticmethod
+    def transposition_key(state: TetrisState) -> tuple:
+        return (state.game, state.piece, tuple(state.next_pieces))
+
+    def transpose(self, node):
+        self.transpositions[self.transposition_key(node.state)] = node
+
+    def transposed(self, state: TetrisState, cost: int, depth: int) -> bool:
+        """Whether 'state' has already been reached by a node with a cost and depth that aren't greater. If not, the new node must be recorded with transpose()."""
+        best = self.transpositions.get(self.transposition_key(state))
+        if best is not None and best.cost <= cost and best.depth <= depth:
+            self.transposition_hits += 1
+            return True
+        return False
+
+    def forget(self, node):
+        """Remove a node pruned from the open nodes from the transposition table, so that its state can be reached again by other nodes."""
+        key = self.transposition_key(node.state)
+        if self.transpositions.get(key) is node:
+            self.transpositions.pop(key)
+
+    # Generate the children of a node
+    def expand(self, node):
+        self.expansions += 1
+        lnewnodes = []
+        t = time()
+        actions = self.problem.domain.actions(node.state)
+        if node is self.root and self.root_actions is not None:
+            actions = [ a for a in actions if a in self.root_actions ]
+        self.time_stats["actions"] += time() - t
+        for a in actions:
+            t = time()
+            newstate = self.problem.domain.result(node.state,a)
+            self.time_stats["result"] += time() - t
+            t = time()
+            cost = node.cost+self.problem.domain.cost(node.state,a)
+            self.time_stats["cost/heuristic"] += time() - t
+            if not self.transposed(newstate, cost, node.depth+1):
+                newnode = SearchNode(newstate,node,cost,0,a)
+                self.transpose(newnode)
+                lnewnodes.append(newnode)
+
+        # The heuristic of all children is evaluated at once
+        t = time()
+        heuristics = self.problem.domain.heuristic_batch([ newnode.state for newnode in lnewnodes ], self.problem.goal)
+        self.time_stats["cost/heuristic"] += time() - t
+        for newnode, heuristic in zip(lnewnodes, heuristics):
+            newnode.heuristic = heuristic
+        self.memory_stats["nodes"] += len(lnewnodes)
+        self.memory_stats["created"] += len(lnewnodes)
+        return lnewnodes
+
+    def stopped(self, deadline: float) -> bool:
+        return time() > deadline or (self.cancelled is not None and self.cancelled())
+
+    # 'deadline' is the time at which the search is stopped, by default it's 'time_cap' seconds from now
+    def search(self, deadline: float=None):
         all_depth = [0]
         tt = time()
-        while self.open_nodes != []:
-            node = self.open_nodes.pop(0)
+        deadline = tt + self.time_cap if deadline is None else deadline
+        while self.open_nodes:
+            node = self.open_nodes.pop()
             if self.problem.goal_test(node.state):
                 return self.terminate(node, all_depth, tt)
 
             self.non_terminals = self.non_terminals + 1
 
-            lnewnodes = []
             if self.limit is not None and node.depth >= self.limit:
                 continue
 
-            t = time()
-            actions = self.problem.domain.actions(node.state)
-            self.time_stats["actions"] += time() - t
-            for a in actions:
-                t = time()
-                newstate = self.problem.domain.result(node.state,a)
-                self.time_stats["result"] += time() - t
-                if not node.in_parent(newstate):
-                    t = time()
-                    newnode = SearchNode(newstate,node,
-                        node.cost+self.problem.domain.cost(node.state,a),
-                        self.problem.domain.heuristic(newstate,self.problem.goal),
-                        a)
-                    self.time_stats["cost/heuristic"] += time() - t
-                    lnewnodes.append(newnode)
-                    # Average node depth
-                    all_depth.append(newnode.depth)
-                    # Lowest cost note
-                    if self.lowest_astar_node[1] is None or self.node_order(newnode)[1] < self.lowest_astar_node[1]:
-                        self.lowest_astar_node = (newnode, newnode.cost + newnode.heuristic)
-
-            if time() - tt > self.time_cap:
+            # Nodes expanded in previous searches are reused
+            lnewnodes = node.children
+            if lnewnodes is None:
+                lnewnodes = self.expand(node)
+                if self.keep_children:
+                    node.children = lnewnodes
+            for newnode in lnewnodes:
+                # Average node depth
+                all_depth.append(newnode.depth)
+                # Lowest cost note
+                if self.lowest_astar_node[1] is None or self.node_order(newnode)[1] < self.lowest_astar_node[1]:
+                    self.lowest_astar_node = (newnode, newnode.cost + newnode.heuristic)
+
+            if self.stopped(deadline):
                 break
-            self.open_nodes.extend(lnewnodes)
-            self.open_nodes = sorted(self.open_nodes, key=self.node_order)[:self.pcaps[node.depth]]
+            # Prune the open nodes to the best ones, the same as keeping the best of the open nodes and the children together
+            cap = self.pcaps[node.depth]
+            for dropped in self.open_nodes.prune(cap):
+                self.forget(dropped)
+            for newnode in lnewnodes:
+                dropped = self.open_nodes.push_bounded(newnode, cap)
+                if dropped is not None:
+                    self.forget(dropped)
+            if len(self.open_nodes) > self.memory_stats["peak_open"]:
+                self.memory_stats["peak_open"] = len(self.open_nodes)
 
         return self.terminate(self.lowest_astar_node[0], all_depth, tt, "BEST EFFORT")
 
+    def search_anytime(self):
+        """
+Iterative deepening version of search(), with depth limits from 1 up to the length of 'pcaps', until 'time_cap' is reached.
+The result of the deepest iteration that was completed is kept, so there is always a plan ready.
+Nodes expanded in previous iterations, or before the tree was rerooted, aren't expanded again.
+        """
+        deadline = time() + self.time_cap
+        best = None
+        self.keep_children = True
+        for limit in range(1, len(self.pcaps)+1):
+            self.limit = limit
+            self.open_nodes = Frontier(self.node_order)
+            self.open_nodes.push(self.root)
+            self.lowest_astar_node = (self.root, None)
+            self.search(deadline)
+
+            if self.stopped(deadline) and best is not None:
+                self.solution, self.plan, self.method = best
+                break
+            best = (self.solution, self.plan, self.method)
+            if self.method == "SOLUTION" or self.stopped(deadline):
+                break
+
+        return self.get_path(self.solution)
+
+    def reroot(self, problem: SearchProblem) -> bool:
+        """
+Reuse the tree for the next piece. The root's child whose game and piece are those of the new initial state becomes the root, and the other nodes are discarded.
+The states of the subtree are updated with the pieces that have been revealed since, and their costs and depths are made relative to the new root.
+Returns False, leaving the tree unchanged, if no child matches (for example, if the piece wasn't placed as planned).
+        """
+        initial = problem.initial
+        root = next((child for child in self.root.children or [] if child.state.game == initial.game and child.state.piece == initial.piece), None)
+        if root is None:
+            return False
+
+        pieces = [initial.piece] + initial.next_pieces
+        base_cost = root.cost
+        base_depth = root.depth
+        root.parent = None
+        root.pre_action = None
+
+        # The table is rebuilt with the states, costs and depths of the remaining subtree
+        self.transpositions = LRUCache(problem.domain.cache_size)
+        self.memory_stats["nodes"] = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self.memory_stats["nodes"] += 1
+            node.cost -= base_cost
+            node.depth -= base_depth
+            if node.depth == 0:
+                node.state = initial
+            else:
+                piece = pieces[node.depth] if node.depth < len(pieces) else problem.domain.FLEX_PIECE
+                # Nodes whose piece was unknown couldn't be expanded before
+                if piece and not node.state.piece:
+                    node.children = None
+                node.state = TetrisState(node.state.game, piece, pieces[node.depth+1:])
+            self.transpose(node)
+            if node.children:
+                stack.extend(node.children)
+
+        self.problem = problem
+        self.root = root
+        self.open_nodes = Frontier(self.node_order)
+        self.open_nodes.push(root)
+        self.lowest_astar_node = (root, None)
+        self.solution = None
+        self.plan = []
+        return True
+
     # Used to terminate a search. Avoids repeated blocks of code (since the search is terminated for different reasons).
     def terminate(self, node, all_depth, tt, method: str="SOLUTION"):
         self.solution = node
+        self.method = method
         self.terminals = len(self.open_nodes) + 1
         self.avg_branching = round((self.non_terminals + self.terminals - 1)/(self.non_terminals), 2)
         self.average_depth = sum(all_depth)/len(all_depth)
@@ -287,12 +652,14 @@ class SearchTree:
         Non terminal nodes: %d
         Average depth: %f
         Average branching: %f
+        Transposition hits: %d
+        Nodes: %d (%d created, at most %d open)
         Times:
             actions - %s
             result  - %s
             cost/heuristic - %s
             total   - %s
-        """, self.terminals, self.non_terminals, self.average_depth, self.avg_branching, self.time_stats["actions"], self.time_stats["result"], self.time_stats["cost/heuristic"], self.time_stats["total"])
+        """, self.terminals, self.non_terminals, self.average_depth, self.avg_branching, self.transposition_hits, self.memory_stats["nodes"], self.memory_stats["created"], self.memory_stats["peak_open"], self.time_stats["actions"], self.time_stats["result"], self.time_stats["cost/heuristic"], self.time_stats["total"])
         return self.get_path(node)
 
     @property
@@ -10,6 +10,7 @@ import websockets
 import pygame
 
 from common import Dimensions
+from protocol import Decoder, MODES
 
 logging.basicConfig(level=logging.DEBUG)
 logger_websockets = logging.getLogger("websockets")
@@ -33,14 +34,15 @@ COLORS = {
 }
 
 
-async def messages_handler(websocket_path, queue):
-    """Handles server side messages, putting them into a queue."""
+async def messages_handler(websocket_path, queue, mode="full"):
+    """Handles server side messages, putting them (decoded) into a queue."""
     async with websockets.connect(websocket_path) as websocket:
-        await websocket.send(json.dumps({"cmd": "join"}))
+        await websocket.send(json.dumps({"cmd": "join", "mode": mode}))
+        decoder = Decoder(mode)
 
         while True:
             update = await websocket.recv()
-            queue.put_nowait(update)
+            queue.put_nowait(decoder.decode(update))
 
 
 def scale(pos):
@@ -78,7 +80,7 @@ async def main_loop(queue):
     logging.info("Waiting for map information from server")
     state = await queue.get()  # first state message includes map information
     logging.debug("Initial game status: %s", state)
-    newgame_json = json.loads(state)
+    newgame_json = state
     player_name = ""
 
     win.fill((0, 0, 0))
@@ -111,7 +113,7 @@ async def main_loop(queue):
             asyncio.get_event_loop().stop()
 
         try:
-            state = json.loads(queue.get_nowait())
+            state = queue.get_nowait()
             if "score" in state:
                 score = state["score"]
             if "player" in state:
@@ -198,6 +200,9 @@ if __name__ == "__main__":
         "--scale", help="reduce size of window by x times", type=int, default=1
     )
     parser.add_argument("--port", help="TCP port", type=int, default=PORT)
+    parser.add_argument(
+        "--mode", help="mode of the game states (see protocol.py)", choices=MODES, default="full"
+    )
     parser.add_argument(
         "--global-highscores",
         help="Retrieve global highscores",
@@ -225,7 +230,7 @@ if __name__ == "__main__":
 
     try:
         LOOP.run_until_complete(
-            asyncio.gather(messages_handler(ws_path, q), main_loop(q))
+            asyncio.gather(messages_handler(ws_path, q, arguments.mode), main_loop(q))
         )
     except RuntimeError as err:
         logger.error(err)
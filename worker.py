@@ -0,0 +1,158 @@
+# Filipe Gonçalves, 98083
+# Pedro Figueiredo, 97487
+# Martinho Tavares, 98262
+
+"""
+Background search, so that the client's event loop keeps receiving game updates while planning.
+The search runs in a separate process, which keeps its own TetrisDomain (and caches) between pieces.
+Searches that are no longer needed (such as a plan prefetched for a state that wasn't reached) are abandoned: each search is tagged with the generation
+of the searcher when it was submitted, and stops at its next expansion once abandon() has moved on to the next generation.
+
+ParallelSearch splits the actions of the root between a pool of processes instead, each one searching its part of the tree.
+"""
+
+import asyncio
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import Value
+from typing import List, Tuple
+
+from bot import Bot, Game, Piece, TetrisState
+from tree_search import SearchTree, SearchProblem, TetrisDomain
+
+# Search state of the worker process
+_domain = None
+_tree = None
+# Current generation of the searcher, shared with the main process
+_generation = None
+
+
+def pack(tstate: TetrisState) -> Tuple:
+    """Compact representation of a TetrisState, that is sent between processes."""
+    return (tstate.game.lines, tstate.piece.lines, [ n.lines for n in tstate.next_pieces ])
+
+def unpack(packed: Tuple) -> TetrisState:
+    game, piece, next_pieces = packed
+    return TetrisState(Game.fromlines(game), Piece.fromlines(piece), [ Piece.fromlines(n) for n in next_pieces ])
+
+
+def _initialize(dimensions: List[int], params: dict, cache_size: int, generation):
+    global _domain, _generation
+    Bot.update_dimensions(*dimensions)
+    Bot.resize_caches(cache_size)
+    _domain = TetrisDomain(**params, cache_size=cache_size)
+    _generation = generation
+
+def _abandoned(generation: int):
+    """Function that tells if the searches of 'generation' have been abandoned."""
+    return lambda: _generation.value != generation
+
+def _plan(packed: Tuple, pcaps: List[int], time_cap: float, anytime: bool, generation: int) -> List[Tuple[int]]:
+    global _tree
+    tstate = unpack(packed)
+    problem = SearchProblem(_domain, tstate, tstate)
+    if anytime:
+        # Reuse the tree of the previous search, if the piece was placed as planned
+        if _tree is None or not _tree.reroot(problem):
+            _tree = SearchTree(problem, pcaps=pcaps, time_cap=time_cap)
+        _tree.pcaps = pcaps
+        _tree.time_cap = time_cap
+        _tree.cancelled = _abandoned(generation)
+        _tree.search_anytime()
+    else:
+        _tree = SearchTree(problem, pcaps=pcaps, time_cap=time_cap)
+        _tree.cancelled = _abandoned(generation)
+        _tree.search()
+    return _tree.plan
+
+def _search_split(packed: Tuple, root_actions: List[Tuple[int]], pcaps: List[int], time_cap: float, anytime: bool, generation: int) -> Tuple:
+    """Search the subtree of 'root_actions'. Returns what is needed to compare the result with those of the other subtrees."""
+    tstate = unpack(packed)
+    tree = SearchTree(SearchProblem(_domain, tstate, tstate), pcaps=pcaps, time_cap=time_cap, root_actions=root_actions)
+    tree.cancelled = _abandoned(generation)
+    if anytime:
+        tree.search_anytime()
+    else:
+        tree.search()
+    node = tree.solution
+    return (tree.method, tree.node_order(node), node.cost + node.heuristic, tree.plan)
+
+def split(actions: List[Tuple[int]], parts: int) -> List[List[Tuple[int]]]:
+    """Split the actions in at most 'parts' parts. They are dealt alternately, so that each part has placements all over the game."""
+    return [ actions[idx::parts] for idx in range(min(parts, len(actions))) ]
+
+def merge(results: List[Tuple]) -> List[Tuple[int]]:
+    """
+Choose the plan of the best subtree, in the same way that a single search would:
+the solution that comes first in the search order, or the lowest A* cost if no subtree found a solution.
+    """
+    solutions = [ r for r in results if r[0] == "SOLUTION" ]
+    if solutions:
+        return min(solutions, key=lambda r: r[1])[3]
+    return min(results, key=lambda r: r[2])[3]
+
+
+class SearchWorker:
+    """
+Runs SearchTree searches in a separate process, with a domain equal to 'domain'.
+Bot.update_dimensions() should be called before creating the worker.
+    """
+
+    def __init__(self, domain: TetrisDomain, anytime: bool=False):
+        self.anytime = anytime
+        self.generation = Value("i", 0, lock=False)
+        self.executor = ProcessPoolExecutor(1,
+            initializer=_initialize,
+            initargs=(list(Bot.dimensions), domain.params, domain.cache_size, self.generation))
+
+    def plan(self, tstate: TetrisState, pcaps: List[int], time_cap: float) -> asyncio.Future:
+        """Start searching for a plan for 'tstate'. The returned future is done once the plan is ready."""
+        return asyncio.get_event_loop().run_in_executor(self.executor, _plan, pack(tstate), list(pcaps), time_cap, self.anytime, self.generation.value)
+
+    def abandon(self, plan: asyncio.Future):
+        """Stop the searches started so far, of which 'plan' is no longer needed. The next search doesn't wait for them to run out of time."""
+        plan.cancel()
+        self.generation.value += 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ParallelSearch:
+    """
+Searches with the actions of the root split between 'workers' processes (all cores by default), each one searching its subtree with the same 'pcaps' and time cap.
+Bot.update_dimensions() should be called before creating it.
+    """
+
+    def __init__(self, domain: TetrisDomain, workers: int=None, anytime: bool=False):
+        self.anytime = anytime
+        self.workers = workers or os.cpu_count() or 1
+        self.generation = Value("i", 0, lock=False)
+        self.executor = ProcessPoolExecutor(self.workers,
+            initializer=_initialize,
+            initargs=(list(Bot.dimensions), domain.params, domain.cache_size, self.generation))
+
+    def submit(self, tstate: TetrisState, pcaps: List[int], time_cap: float) -> List[Future]:
+        packed = pack(tstate)
+        return [ self.executor.submit(_search_split, packed, actions, list(pcaps), time_cap, self.anytime, self.generation.value)
+            for actions in split(Bot.get_actions(tstate.piece), self.workers) ]
+
+    def search(self, tstate: TetrisState, pcaps: List[int], time_cap: float) -> List[Tuple[int]]:
+        """Return the plan for 'tstate', waiting for all subtrees."""
+        return merge([ f.result() for f in self.submit(tstate, pcaps, time_cap) ])
+
+    def plan(self, tstate: TetrisState, pcaps: List[int], time_cap: float) -> asyncio.Future:
+        """Same as search(), but the returned future is done once the plan is ready, as in SearchWorker.plan()."""
+        futures = [ asyncio.wrap_future(f) for f in self.submit(tstate, pcaps, time_cap) ]
+        return asyncio.ensure_future(self._merge(futures))
+
+    async def _merge(self, futures: List[asyncio.Future]) -> List[Tuple[int]]:
+        return merge(await asyncio.gather(*futures))
+
+    def abandon(self, plan: asyncio.Future):
+        """Same as SearchWorker.abandon()."""
+        plan.cancel()
+        self.generation.value += 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)